@@ -1,4 +1,11 @@
-from collections import defaultdict
+from collections.abc import MutableMapping, Sequence
+
+import numpy as np
+
+import graph_utils
+from agent_store import NONE, AgentRefField, AgentStore, AgentView, EnumField, IntField
+import simulation
+from simulation import TRACE_FINAL, TRACE_MOVE, TRACE_NONE, TRACE_ROUND, Metrics, RunResult, check_trace_level
 
 AgentStatus = {
     "SETTLED": 0,
@@ -11,17 +18,43 @@ NodeStatus = {
     "OCCUPIED": 1,
 }
 
-class Agent:
+SETTLED, UNSETTLED, SETTLED_WAIT = (AgentStatus[s] for s in ("SETTLED", "UNSETTLED", "SETTLED_WAIT"))
+
+PHASES = ("probe_out", "probe_back", "move_out")  # the sub-rounds of a macro-round, for Metrics
+
+
+class Agent(AgentView):
+    """A drop-freeze agent: a __slots__ view onto its row of an AgentStore.
+
+    run_simulation adopts the agents into a store; until then the fields
+    live in the view itself. `state` is the old status/level/leader/home
+    dict, as a view over the fields of the same names.
+    """
+    __slots__ = ("id",)
+
+    currentnode = IntField()
+    status = IntField()  # an AgentStatus value
+    level = IntField()
+    leader = AgentRefField()
+    home = IntField()
+    probe_home = IntField()
+    probe_port = IntField()
+    probe_result_empty = EnumField((None, False, True))
+    pin = IntField()
+    parent_port = IntField()
+    next_port_to_try = IntField()
+    entry_pin = IntField()
+    moves = IntField(dtype="int64")
+
     def __init__(self, id, initial_node):
+        super().__init__()
         self.id = id
         self.currentnode = initial_node
 
-        self.state = {
-            "status": AgentStatus["UNSETTLED"],
-            "level": 0,
-            "leader": self,
-            "home": None,
-        }
+        self.status = AgentStatus["UNSETTLED"]
+        self.level = 0
+        self.leader = self
+        self.home = None
 
         # probe memory (used across probe_out -> probe_back -> move_out)
         self.probe_home = None          # node we will return to
@@ -32,59 +65,191 @@ class Agent:
         self.parent_port = None      # saved when this agent becomes settled
         self.next_port_to_try = 0    # DFS cursor at settled nodes
         self.entry_pin = None  
+        self.moves = 0               # edge traversals, for RunResult
+
+    @property
+    def state(self):
+        return _State(self)
 
 
-def _ordered_ports(G, u):
-    port_map = G.nodes[u]["port_map"]
-    nbr_to_port_u = G.nodes[u]["nbr_to_port"]
+_EMPTY = Agent.probe_result_empty.codes  # probe_result_empty value -> its column code
 
-    def rank(p):
-        v = port_map[p]
-        p_vu = G.nodes[v]["nbr_to_port"][u]
-        local_is_p1  = (p == 0)
-        remote_is_p1 = (p_vu == 0)
-        if (not local_is_p1) and remote_is_p1:
-            return (0, p)
-        if local_is_p1:
-            return (1, p)
-        return (2, p)
 
-    return sorted(port_map.keys(), key=rank)
+class _State(MutableMapping):
+    """Agent.state: {"status", "level", "leader", "home"} backed by the agent's fields."""
+    __slots__ = ("_agent",)
+    _KEYS = ("status", "level", "leader", "home")
 
+    def __init__(self, agent):
+        self._agent = agent
 
+    def __getitem__(self, key):
+        if key not in self._KEYS:
+            raise KeyError(key)
+        return getattr(self._agent, key)
 
-def _positions_and_statuses(agents):
-    return [a.currentnode for a in agents], [a.state["status"] for a in agents]
+    def __setitem__(self, key, value):
+        if key not in self._KEYS:
+            raise KeyError(key)
+        setattr(self._agent, key, value)
 
+    def __delitem__(self, key):
+        raise TypeError("agent state keys cannot be removed")
 
-def _snapshot(all_positions, all_statuses, all_leaders, all_levels, all_node_states,
-              label, G, agents):
-    positions, statuses = _positions_and_statuses(agents)
+    def __iter__(self):
+        return iter(self._KEYS)
 
-    # node settled states for UI (keep keys compatible with existing JSON)
-    node_states = {}
-    for node_id in G.nodes():
-        sa = G.nodes[node_id].get("settled_agent")
-        if sa is None:
-            node_states[str(node_id)] = None
-        else:
-            node_states[str(node_id)] = {
-                "settled_agent_id": sa.id,
-                "parent_port": None,
-                "checked_port": None,
-                "max_scouted_port": None,
-                "next_port": None,
-            }
+    def __len__(self):
+        return len(self._KEYS)
 
-    all_positions.append((label, positions))
-    all_statuses.append((label, statuses))
-    all_node_states.append((label, node_states))
-    all_leaders.append((label, [a.state["leader"].id for a in agents]))
-    all_levels.append((label, [a.state["level"] for a in agents]))
-    return positions, statuses
+    def __repr__(self):
+        return repr(dict(self))
+
+
+def _port_order(G):
+    """The order drop-freeze tries the ports of every node in, as CSR arrays.
+
+    Ports whose far end is port 0 come first, then port 0, then the rest,
+    ascending within each class. For node u, ordered[offsets[u] + i] is its
+    i-th port and rank[offsets[u] + p] the position of port p; deg[u] is
+    its degree.
+    """
+    off = G.offsets
+    deg = np.diff(off)
+    src = np.repeat(np.arange(len(off) - 1), deg)
+    port = np.arange(len(G.neighbors)) - off[src]
+    cls = np.where(port == 0, 1, np.where(G.rev_ports == 0, 0, 2))
+    slots = np.lexsort((port, cls, src))
+    ordered = port[slots].astype(np.int32)
+    rank = np.empty(len(slots), dtype=np.int32)
+    rank[slots] = np.arange(len(slots)) - off[src]
+    return ordered, rank, deg
+
+
+def _positions_and_statuses(store):
+    return store.columns["currentnode"].tolist(), store.columns["status"].tolist()
+
+
+def _node_state(agent_id):
+    # a settled node's state for the UI (keys kept compatible with existing JSON)
+    return {
+        "settled_agent_id": agent_id,
+        "parent_port": None,
+        "checked_port": None,
+        "max_scouted_port": None,
+        "next_port": None,
+    }
+
+
+class _Trace:
+    """Frames of a run, one per snapshot.
+
+    Agent positions and statuses are kept in full. A node's state only
+    changes when an agent settles there, so node states are kept as sparse
+    diffs: `node_diffs[r]` is (label, {node: state}) for the nodes whose
+    state changed since frame r-1 (frame 0 against all-empty). Leaders and
+    levels never change during a run and are kept once. `node_states`,
+    `leaders` and `levels` are lazy ``[(label, data), ...]`` views that
+    rebuild full frames on demand.
+    """
+    def __init__(self, G, store):
+        self.num_nodes = G.number_of_nodes()
+        self.ids = [a.id for a in store.agents]
+        self.labels = []
+        self.positions = []
+        self.statuses = []
+        self.node_diffs = []
+        self._seen = np.full(self.num_nodes, NONE, dtype=np.int32)  # settled rows as of the last frame
+        self._leaders = [self.ids[row] for row in store.columns["leader"].tolist()]
+        self._levels = store.columns["level"].tolist()
+        self.leaders = _Frames(self.labels, self._repeat_leaders)
+        self.levels = _Frames(self.labels, self._repeat_levels)
+        self.node_states = _Frames(self.labels, self._replay)
+        self.node_states.diffs = self.node_diffs
+
+    def snapshot(self, label, settled, store):
+        positions, statuses = _positions_and_statuses(store)
+        changed = np.flatnonzero(settled != self._seen)
+        rows = settled[changed]
+        self._seen[changed] = rows
+        self.labels.append(label)
+        self.positions.append((label, positions))
+        self.statuses.append((label, statuses))
+        self.node_diffs.append((label, {
+            str(u): None if row == NONE else _node_state(self.ids[row])
+            for u, row in zip(changed.tolist(), rows.tolist())}))
+
+    def _repeat_leaders(self, frames):
+        return (list(self._leaders) for _ in frames)
+
+    def _repeat_levels(self, frames):
+        return (list(self._levels) for _ in frames)
+
+    def _replay(self, frames):
+        # full node-state dicts of `frames` (ascending), replaying the diffs once
+        state = dict.fromkeys(map(str, range(self.num_nodes)))
+        applied = 0
+        for r in frames:
+            for _, diff in self.node_diffs[applied:r + 1]:
+                state.update(diff)
+            applied = max(applied, r + 1)
+            yield dict(state)
+
+    def frames(self):
+        return self.positions, self.statuses, self.leaders, self.levels, self.node_states
+
+
+class _Frames(Sequence):
+    """Read-only ``[(label, data), ...]`` view; render(frame numbers) yields
+    the data of those (ascending) frames."""
+    def __init__(self, labels, render):
+        self._labels = labels
+        self._render = render
+
+    def __len__(self):
+        return len(self._labels)
+
+    def __getitem__(self, r):
+        if isinstance(r, slice):
+            rs = range(*r.indices(len(self)))
+            return [(self._labels[i], data) for i, data in zip(rs, self._render(rs))]
+        if r < 0:
+            r += len(self)
+        if not 0 <= r < len(self):
+            raise IndexError(r)
+        return (self._labels[r], next(iter(self._render([r]))))
+
+    def __iter__(self):
+        rs = range(len(self))
+        for r, data in zip(rs, self._render(rs)):
+            yield (self._labels[r], data)
+
+    def __eq__(self, other):
+        if not isinstance(other, Sequence):
+            return NotImplemented
+        return list(self) == list(other)
+
+
+def _unsettled_groups(store, active):
+    """The `active` rows (the UNSETTLED ones, in agent-ID order) sorted by
+    (node, id), their nodes, the index where each node's run of rows starts,
+    and each row's run number."""
+    rows = active
+    nodes = store.columns["currentnode"][rows]
+    order = np.argsort(nodes, kind="stable")
+    rows, nodes = rows[order], nodes[order]
+    first = np.empty(len(rows), dtype=np.bool_)
+    first[:1] = True
+    np.not_equal(nodes[1:], nodes[:-1], out=first[1:])
+    return rows, nodes, np.flatnonzero(first), np.cumsum(first) - 1
 
 def _init_ports(G):
-    # Deterministic local ports + inverse map (neighbor -> port)
+    # Deterministic local ports (ascending neighbor id): returns that
+    # PortGraph and its _port_order tables. For a PortGraph both are cached
+    # on it (port_table), so later runs on the same graph reuse them.
+    if isinstance(G, graph_utils.PortGraph):
+        G = G.port_table("sorted_ports", graph_utils.sort_ports)
+        return G, G.port_table("drop_freeze_order", _port_order)
     for u in G.nodes:
         nbrs = sorted(G.neighbors(u))
         G.nodes[u]["port_map"] = {i: v for i, v in enumerate(nbrs)}
@@ -94,253 +259,237 @@ def _init_ports(G):
     for u, v in G.edges:
         G[u][v][f"port_{u}"] = G.nodes[u]["nbr_to_port"][v]
         G[u][v][f"port_{v}"] = G.nodes[v]["nbr_to_port"][u]
+    G = graph_utils.to_port_graph(G)
+    return G, G.port_table("drop_freeze_order", _port_order)
+
 
+# The three sub-rounds work on whole columns of the store at once: rows are
+# grouped by node with a sort, and each group's decision is taken with
+# array operations over all groups together. `settled` holds the row of the
+# agent settled at each node (NONE if empty) and `ports` is _port_order(G).
+# Only the frontier is touched: `active` holds the rows still UNSETTLED, in
+# agent-ID order, and each sub-round returns the number of moves it made, so
+# late rounds cost time in the agents left rather than in k.
 
-def _probe_out(G, node_to_agents):
+def _probe_out(G, ports, settled, store, active):
     """
-    All UNSETTLED (non-settled) agents at each node fan out to distinct ports.
-    One agent per port (up to degree).
+    All UNSETTLED agents at each node fan out to distinct ports, one agent
+    per port (up to degree), starting at the settled agent's DFS cursor.
+    A lone agent on an empty node stays and settles in _move_out.
+    Returns the rows of the probing agents.
     """
-    moves = []  # list of (agent, src, dst, port)
-
-    for u, agents_here in node_to_agents.items():
-        settled = G.nodes[u].get("settled_agent")
-        unsettled = [a for a in agents_here if a is not settled and a.state["status"] == AgentStatus["UNSETTLED"]]
-        if not unsettled:
-            continue
-        unsettled.sort(key=lambda a: a.id)
-        for a in unsettled:
-            a.probe_home = None
-            a.probe_port = None
-            a.probe_result_empty = None
-
-        if settled is None and len(unsettled) == 1:
-            continue
-
-        deg = G.degree[u]
-        if deg == 0:
-            continue
-
-        sa = G.nodes[u].get("settled_agent")
-        ports = _ordered_ports(G, u)
-
-        start = sa.next_port_to_try if sa is not None else 0
-        ports_to_probe = ports[start:]
-        for a, port in zip(unsettled, ports_to_probe):
-            v = G.nodes[u]["port_map"].get(port)
-            if v is None:
-                continue
-            a.probe_home = u
-            a.probe_port = port
-            a.probe_result_empty = None
-            a.state["status"] = AgentStatus["SETTLED_WAIT"]
-            moves.append((a, u, v, port))
-
-    for a, u, v, _port in moves:
-        back_port = G[u][v][f"port_{v}"]
-        G.nodes[u]["agents"].remove(a)
-        a.currentnode = v
-        G.nodes[v]["agents"].add(a)
-
-
-def _probe_back(G, agents):
+    cols = store.columns
+    rows, nodes, starts, group = _unsettled_groups(store, active)
+    cols["probe_home"][rows] = NONE
+    cols["probe_port"][rows] = NONE
+    cols["probe_result_empty"][rows] = _EMPTY[None]
+    if not len(rows):
+        return rows
+
+    off = G.offsets
+    ordered, rank, deg = ports
+    gnode = nodes[starts]
+    sa = settled[gnode]
+    count = np.diff(np.append(starts, len(rows)))
+    cursor = np.where(sa != NONE, cols["next_port_to_try"][sa], 0)
+    cursor[cursor == NONE] = 0
+    skip = ((sa == NONE) & (count == 1)) | (deg[gnode] == 0)
+    idx = cursor[group] + (np.arange(len(rows)) - starts[group])
+    probe = ~skip[group] & (idx < deg[nodes])
+
+    prow, pu = rows[probe], nodes[probe]
+    port = ordered[off[pu] + idx[probe]]
+    cols["probe_home"][prow] = pu
+    cols["probe_port"][prow] = port
+    cols["status"][prow] = SETTLED_WAIT
+    cols["currentnode"][prow] = G.neighbors[off[pu] + port]
+    cols["moves"][prow] += 1
+    return prow
+
+
+def _probe_back(G, settled, store, rows):
     """
-    Every PROBING agent checks whether its current node is empty (no settled_agent),
-    then returns to its probe_home.
+    Every PROBING agent (`rows`, from _probe_out) checks whether its current
+    node is empty (no settled agent), then returns to its probe_home.
+    Returns the number of moves made.
     """
-    moves = []  # list of (agent, src, home)
-
-    for a in agents:
-        if a.state["status"] != AgentStatus["SETTLED_WAIT"]:
-            continue
-        src = a.currentnode
-        # "empty" means no settled agent at that node
-        a.probe_result_empty = (G.nodes[src].get("settled_agent") is None)
-        home = a.probe_home
-        if home is None:
-            a.state["status"] = AgentStatus["UNSETTLED"]
-            continue
-        moves.append((a, src, home))
-
-    # execute returns simultaneously
-    for a, src, home in moves:
-        back_port = G[src][home][f"port_{home}"]
-        G.nodes[src]["agents"].remove(a)
-        a.currentnode = home
-        G.nodes[home]["agents"].add(a)
-        a.state["status"] = AgentStatus["UNSETTLED"]
-
-def _move_out(G, node_to_agents):
-    planned_moves = []
-    unsettled_by_node = {}
-    AS = AgentStatus
-    NS = NodeStatus
-
-    # Collect unsettled movers at each node (excluding the local settled agent object)
-    for u, agents_here in node_to_agents.items():
-        settled = G.nodes[u].get("settled_agent")
-        movers = [a for a in agents_here
-                  if a is not settled and a.state["status"] == AS["UNSETTLED"]]
-        if movers:
-            movers.sort(key=lambda a: a.id)
-            unsettled_by_node[u] = movers
+    cols = store.columns
+    cols["probe_result_empty"][rows] = np.where(
+        settled[cols["currentnode"][rows]] == NONE, _EMPTY[True], _EMPTY[False])
+    home = cols["probe_home"][rows]
+    back = home != NONE
+    cols["currentnode"][rows[back]] = home[back]
+    cols["moves"][rows[back]] += 1
+    cols["status"][rows] = UNSETTLED
+    return int(np.count_nonzero(back))
+
+
+def _move_out(G, ports, settled, store, active, ids, events):
+    """
+    Phase 1: the lowest-ID agent on every empty node with UNSETTLED agents
+    settles there. Phase 2: the other agents on each node move together
+    through the first port (from the cursor on) that a probe found empty;
+    if there is none and every port has been probed, they backtrack through
+    the settled agent's parent port. Returns the number of moves made.
+    """
+    cols = store.columns
+    rows, nodes, starts, group = _unsettled_groups(store, active)
+    if not len(rows):
+        return 0
+    off = G.offsets
+    ordered, rank, deg = ports
+    gnode = nodes[starts]
+    next_port = cols["next_port_to_try"]
+    parent_port = cols["parent_port"]
 
     # Phase 1: settle one agent at any empty node that currently has movers
-    newly_settled_nodes = set()
-    for u, movers in unsettled_by_node.items():
-        if G.nodes[u].get("settled_agent") is None and movers:
-            to_settle = movers.pop(0)
-            to_settle.state["status"] = AS["SETTLED"]
-            to_settle.next_port_to_try = 0
-
-            # Parent is the port used to enter this node (if valid)
-            to_settle.parent_port = to_settle.entry_pin
-            pnode = G.nodes[u]["port_map"].get(to_settle.parent_port)
-            if pnode is None:
-                to_settle.parent_port = None
-            if to_settle.parent_port not in G.nodes[u]["port_map"]:
-                to_settle.parent_port = None
-
-            G.nodes[u]["settled_agent"] = to_settle
-            G.nodes[u]["node_status"] = NS["OCCUPIED"]
-            newly_settled_nodes.add(u)
-
-    # Phase 2: GROUP DFS move
-    for u, movers in unsettled_by_node.items():
-        if not movers:
-            continue
-
-        sa = G.nodes[u].get("settled_agent")
-        if sa is None:
-            continue
-
-        port_map = G.nodes[u]["port_map"]
-        ports = _ordered_ports(G, u)
-        if not ports:
-            continue
-
-        cursor_idx = sa.next_port_to_try if sa.next_port_to_try is not None else 0
-        port_to_idx = {p:i for i,p in enumerate(ports)}
-
-        # 1) Prefer ports confirmed empty by probe results (this round)
-        probe_empty_ports = []
-        seen = set()
-
-        scouts = list(movers)
-        if u in newly_settled_nodes:
-            scouts.append(sa)
-
-        for a in scouts:
-            if a.probe_home != u or a.probe_result_empty is not True:
-                continue
-            p = a.probe_port
-            if p in port_map and p not in seen :
-                seen.add(p)
-                probe_empty_ports.append(p)
-
-        probe_empty_ports.sort(key=lambda p: port_to_idx.get(p, 10**9))
-
-        chosen_port = None
-
-        # DFS: choose first candidate >= cursor
-        for p in probe_empty_ports:
-            i = port_to_idx.get(p)
-            if i is not None and i >= cursor_idx:
-                chosen_port = p
-                break
-
-        # Forward DFS move: ALL movers go together
-        if chosen_port is not None:
-            v = port_map[chosen_port]
-            sa.next_port_to_try = port_to_idx[chosen_port] + 1
-            for a in movers:
-                planned_moves.append((a, u, v))
-            continue
-
-
-        if chosen_port is None:
-            probed_ports = [
-                a.probe_port
-                for a in scouts
-                if a.probe_home == u and a.probe_port is not None
-            ]
-            probed_count = len(set(probed_ports))
-            sa.next_port_to_try = min(len(ports), cursor_idx + probed_count)
-            if sa.next_port_to_try < len(ports):
-                continue  
-
-
-        # 3) No empty neighbor left -> backtrack to parent as a group
-        if sa.parent_port is not None and sa.parent_port in port_map:
-            v = port_map[sa.parent_port]
-            sa.next_port_to_try = len(ports)
-            for a in movers:
-                planned_moves.append((a, u, v))
-
-    # Execute moves (your original logic)
-    for a, u, v in planned_moves:
-        back_port = G.nodes[v]["nbr_to_port"][u]
-        G.nodes[u]["agents"].remove(a)
-
-        a.currentnode = v
-        a.pin = back_port
-        a.entry_pin = back_port
-
-        a.probe_home = None
-        a.probe_port = None
-        a.probe_result_empty = None
-
-        G.nodes[v]["agents"].add(a)
-
-def run_simulation(G, agents, rounds):
-    for node in G.nodes():
-        G.nodes[node]["agents"] = set()
-        G.nodes[node]["settled_agent"] = None
-        G.nodes[node]["node_status"] = NodeStatus["EMPTY"]
-    _init_ports(G)
-    for a in agents:
-        a.state["status"] = AgentStatus["UNSETTLED"]
-        a.probe_home = None
-        a.probe_port = None
-        a.probe_result_empty = None
-        a.pin = None
-        a.parent_port = None
-        a.next_port_to_try = 0
-        a.entry_pin = None
-
-    for a in agents:
-        G.nodes[a.currentnode]["agents"].add(a)
-
-    all_positions, all_statuses = [], []
-    all_leaders, all_levels = [], []
-    all_node_states = []
-
-    _snapshot(all_positions, all_statuses, all_leaders, all_levels, all_node_states,
-              "start", G, agents)
+    new = settled[gnode] == NONE
+    srows, su = rows[starts[new]], gnode[new]
+    cols["status"][srows] = SETTLED
+    next_port[srows] = 0
+    # parent is the port used to enter this node (if valid)
+    pin = cols["entry_pin"][srows]
+    parent_port[srows] = np.where((pin >= 0) & (pin < deg[su]), pin, NONE)
+    settled[su] = srows
+    if events.active:
+        for row, u in zip(srows.tolist(), su.tolist()):
+            events.emit("settle", agent=int(ids[row]), node=u)
+
+    # Phase 2: group DFS move. Every row of a group scouted for it: the
+    # movers and, on a node settled just now, the new settled agent.
+    mover = np.ones(len(rows), dtype=np.bool_)
+    mover[starts[new]] = False
+    ngroups = len(starts)
+    sa = settled[gnode]
+    d = deg[gnode]
+    active = (np.bincount(group[mover], minlength=ngroups) > 0) & (d > 0)
+    cursor = next_port[sa]
+    cursor[cursor == NONE] = 0
+
+    pport = cols["probe_port"][rows]
+    probed = (cols["probe_home"][rows] == nodes) & (pport != NONE)
+    pidx = np.full(len(rows), NONE, dtype=np.int64)
+    pidx[probed] = rank[off[nodes[probed]] + pport[probed]]
+    # 1) prefer the first port (from the cursor on) a probe found empty
+    empty = probed & (cols["probe_result_empty"][rows] == _EMPTY[True]) & (pidx >= cursor[group])
+    best = np.full(ngroups, np.iinfo(np.int64).max)
+    np.minimum.at(best, group[empty], pidx[empty])
+    chosen = active & (best != np.iinfo(np.int64).max)
+    out_port = np.full(ngroups, NONE, dtype=np.int64)
+    next_port[sa[chosen]] = best[chosen] + 1
+    out_port[chosen] = ordered[off[gnode[chosen]] + best[chosen]]
+
+    # 2) otherwise advance the cursor past the probed ports
+    rest = active & ~chosen
+    keys = np.unique(group[probed].astype(np.int64) * (d.max() + 1) + pport[probed])
+    nprobed = np.bincount(keys // (d.max() + 1), minlength=ngroups)
+    cursor = np.minimum(d, cursor + nprobed)
+    next_port[sa[rest]] = cursor[rest]
+
+    # 3) no empty neighbor left -> backtrack to parent as a group
+    pp = parent_port[sa]
+    back = rest & (cursor >= d) & (pp >= 0) & (pp < d)
+    next_port[sa[back]] = d[back]
+    out_port[back] = pp[back]
+
+    # execute every group move at once
+    go = mover & (out_port[group] != NONE)
+    mrows = rows[go]
+    slot = off[nodes[go]] + out_port[group[go]]
+    back_port = G.rev_ports[slot]
+    cols["currentnode"][mrows] = G.neighbors[slot]
+    cols["moves"][mrows] += 1
+    cols["pin"][mrows] = back_port
+    cols["entry_pin"][mrows] = back_port
+    cols["probe_home"][mrows] = NONE
+    cols["probe_port"][mrows] = NONE
+    cols["probe_result_empty"][mrows] = _EMPTY[None]
+    return len(mrows)
+
+
+def _tree_edges(G, store, by_id):
+    # parent edge of every settled agent, in agent-ID order
+    cols = store.columns
+    rows = by_id[(cols["status"][by_id] == SETTLED) & (cols["parent_port"][by_id] != NONE)]
+    u, port = cols["currentnode"][rows], cols["parent_port"][rows]
+    slot = G.offsets[u] + port
+    return [{"u": str(a), "v": str(b), "srcPort": p, "dstPort": q}
+            for a, b, p, q in zip(u.tolist(), G.neighbors[slot].tolist(),
+                                  port.tolist(), G.rev_ports[slot].tolist())]
+
+
+def _book(metrics, phase, moved):
+    # one sub-round of `phase`, in which `moved` moves were made
+    metrics.rounds[phase] += 1
+    metrics.moves[phase] += moved
+
+
+def run_simulation(G, agents, rounds, trace=TRACE_MOVE, events=None, metrics=None):
+    """Run up to `rounds` macro-rounds (probe_out, probe_back, move_out).
+
+    `trace` is one of simulation.TRACE_LEVELS: "move" snapshots every
+    sub-round, "round" every macro-round, "final" only the end state, and
+    "none" returns a simulation.RunResult instead of the frames
+    (positions, statuses, leaders, levels, node_states). The last three are
+    lazy views; node_states.diffs holds the node states as sparse per-frame
+    diffs, which is what should be serialized.
+    Settle events go to `events` (default: simulation.events) and rounds and
+    moves per sub-round to `metrics` (default: a fresh simulation.Metrics,
+    also found as RunResult.metrics).
+    """
+    check_trace_level(trace)
+    if events is None:
+        events = simulation.events
+    if metrics is None:
+        metrics = Metrics(PHASES)
+    per_step = trace == TRACE_MOVE
+    per_round = trace in (TRACE_MOVE, TRACE_ROUND)
+    G, ports = _init_ports(G)
+    settled = np.full(G.number_of_nodes(), NONE, dtype=np.int32)  # row of the agent settled on each node
+    store = AgentStore.of(agents)
+    ids = np.array([a.id for a in store.agents])
+    by_id = np.argsort(ids, kind="stable")
+    cols = store.columns
+    status = cols["status"]
+    moves = cols["moves"]
+    status[:] = UNSETTLED
+    for name in ("probe_home", "probe_port", "pin", "parent_port", "entry_pin"):
+        cols[name][:] = NONE
+    cols["probe_result_empty"][:] = _EMPTY[None]
+    cols["next_port_to_try"][:] = 0
+    moves[:] = 0
+    active = by_id  # UNSETTLED rows, in agent-ID order
+
+    trace_frames = _Trace(G, store) if trace != TRACE_NONE else None
+    if per_round:
+        trace_frames.snapshot("start", settled, store)
 
     # Each macro-round = 3 synchronous sub-rounds
+    done = 0
     for r in range(1, rounds + 1):
-        if all(a.state["status"] == AgentStatus["SETTLED"] for a in agents):
+        if not len(active):
             break
 
-        node_to_agents = defaultdict(list)
-        for a in agents:
-            node_to_agents[a.currentnode].append(a)
-
-        _probe_out(G, node_to_agents)
-        _snapshot(all_positions, all_statuses, all_leaders, all_levels, all_node_states,
-                  f"round{r}:probe_out", G, agents)
-
-        _probe_back(G, agents)
-        _snapshot(all_positions, all_statuses, all_leaders, all_levels, all_node_states,
-                  f"round{r}:probe_back", G, agents)
-
-        node_to_agents = defaultdict(list)
-        for a in agents:
-            node_to_agents[a.currentnode].append(a)
-
-        _move_out(G, node_to_agents)
-        _snapshot(all_positions, all_statuses, all_leaders, all_levels, all_node_states,
-                  f"round{r}:move_out", G, agents)
-
-    return all_positions, all_statuses, all_leaders, all_levels, all_node_states
\ No newline at end of file
+        probing = _probe_out(G, ports, settled, store, active)
+        _book(metrics, "probe_out", len(probing))
+        if per_step:
+            trace_frames.snapshot(f"round{r}:probe_out", settled, store)
+
+        _book(metrics, "probe_back", _probe_back(G, settled, store, probing))
+        if per_step:
+            trace_frames.snapshot(f"round{r}:probe_back", settled, store)
+
+        _book(metrics, "move_out", _move_out(G, ports, settled, store, active, ids, events))
+        active = active[status[active] == UNSETTLED]
+        if per_round:
+            trace_frames.snapshot(f"round{r}:move_out", settled, store)
+        done = r
+
+    metrics.agent_moves = moves[by_id].tolist()
+    if trace == TRACE_NONE:
+        homes = [None if st != SETTLED else u for u, st in
+                 zip(cols["currentnode"][by_id].tolist(), status[by_id].tolist())]
+        return RunResult(3 * done, homes, _tree_edges(G, store, by_id), metrics.agent_moves, metrics)
+    if trace == TRACE_FINAL:
+        trace_frames.snapshot("final", settled, store)
+    return trace_frames.frames()
@@ -1,153 +1,352 @@
-from typing import List
-import inspect
+from bisect import bisect_left, insort
 import copy
+import copyreg
+import heapq
+from collections.abc import Sequence
+import inspect
+import os
+import pickle
+
+import numpy as np
+
+import graph_utils
+from agent_store import AgentStore, AgentView, BoolField, EnumField, Field, IntField
+import simulation
+from simulation import TRACE_FINAL, TRACE_MOVE, TRACE_NONE, TRACE_ROUND, Metrics, RunResult, check_trace_level
 
 BOTTOM = None
 PORT_ONE = 0
 
-class SIM_DATA:
+def _tree_edge_of(G, a):
+    # (key, edge) for the tree edge agent a stands for, or None
+    if a.state not in ("settled", "settledScout"):
+        return None
+    if a.home is None or a.home is BOTTOM:
+        return None
+    if a.parentPort is None or a.parentPort is BOTTOM:
+        return None
+    u = int(a.home) if str(a.home).isdigit() else a.home
+    v = _port_neighbor(G, u, a.parentPort)
+    return (min(u, v), max(u, v)), {
+        "u": str(u),
+        "v": str(v),
+        "srcPort": a.parentPort,
+        "dstPort": G.reverse_port(u, a.parentPort),
+    }
+
+
+class TreeEdges:
+    """DFS tree edges, maintained as agents settle, re-parent or vacate.
+
+    Every settled agent stands for the edge from its home through its parent
+    port; the tree lists those edges by agent ID, without repeats. Changes
+    are appended to `log`, so `version` (the log length) identifies a tree
+    state and `edges(version)` can rebuild it later.
+    """
     def __init__(self):
-        self.all_positions = []
-        self.all_statuses = []
-        self.all_node_states = []
-        self.all_homes = []
-        self.all_tree_edges = []
-        self.rounds = 0
+        self.by_agent = {}
+        self.log = []
+        self._replay = (0, {})   # (version, by_agent) reached by the last replay
+        self._rendered = (0, [])
+
+    @property
+    def version(self):
+        return len(self.log)
+
+    def update(self, G, a):
+        """Re-read agent a after a state / home / parent transition."""
+        contrib = _tree_edge_of(G, a)
+        if self.by_agent.get(a.ID) == contrib:
+            return
+        if contrib is None:
+            del self.by_agent[a.ID]
+        else:
+            self.by_agent[a.ID] = contrib
+        self.log.append((a.ID, contrib))
+
+    @staticmethod
+    def _render(by_agent):
+        edges = []
+        seen = set()
+        for aid in sorted(by_agent):
+            key, edge = by_agent[aid]
+            if key not in seen:
+                seen.add(key)
+                edges.append(edge)
+        return edges
+
+    def edges(self, version=None):
+        """Tree edge list as of `version` (default: now); cached per version."""
+        if version is None:
+            version = self.version
+        if self._rendered[0] != version:
+            if version == self.version:
+                by_agent = self.by_agent
+            else:
+                at, by_agent = self._replay
+                if at > version:
+                    at, by_agent = 0, {}
+                for aid, contrib in self.log[at:version]:
+                    if contrib is None:
+                        del by_agent[aid]
+                    else:
+                        by_agent[aid] = contrib
+                self._replay = (version, by_agent)
+            self._rendered = (version, self._render(by_agent))
+        return self._rendered[1]
+
+
+class _Marker:
+    # a unique placeholder that stays the same object through pickling, so
+    # checkpointed engines keep using it as a key
+    __slots__ = ("name",)
+
+    def __init__(self, name):
+        self.name = name
+
+    def __reduce__(self):
+        return self.name
+
+    def __repr__(self):
+        return self.name
+
+
+_UNSET = _Marker("_UNSET")
+_ANYWHERE = _Marker("_ANYWHERE")
+
+
+class Recorder:
+    """Append-only, delta-encoded trace of a run.
+
+    Frame r is the state of all agents when round r was first recorded,
+    overwritten by any later single-agent records made for round r. Rather
+    than copying every frame we keep, per round, the agent changes since the
+    previous round was opened (`deltas`) and the later single-agent records
+    (`patches`), plus a full keyframe every `keyframe_every` rounds. `frame(r)`
+    rebuilds one round on demand; `all_positions` etc. are lazy views in the
+    old ``[(label, data), ...]`` shape. Tree edges are kept as a version
+    number into the incrementally maintained `tree`.
+    """
+    def __init__(self, keyframe_every=64):
+        self.keyframe_every = keyframe_every
+        self.level = TRACE_MOVE
+        self.clearr()
+
     def clearr(self):
-        self.all_positions = []
-        self.all_statuses = []
-        self.all_node_states = []
-        self.all_homes = []
-        self.all_tree_edges = []
+        self.labels = []
+        self.tree = TreeEdges()
+        self.tree_versions = []  # tree_versions[r]: self.tree.version last recorded for r
+        self.deltas = []      # deltas[r]: [(idx, node, state, home)] applied when r was opened
+        self.patches = []     # patches[r]: [(idx, node, state, home)] recorded for r afterwards
+        self.keyframes = {}   # r -> (nodes, states, homes) as of r's opening
+        self.order = []       # agents sorted by ID; frame index -> agent
+        self.index = {}       # agent ID -> frame index
+        self._cur = []        # last recorded (node, state, home) per frame index
+        self._pending = []    # changes to _cur not yet attached to a round
         self.rounds = 0
 
-simmer = SIM_DATA()
-
-def _compute_tree_edges(G, arr):
-    edges = []
-    seen = set()
-    for a in arr:
-        if a.state not in ("settled", "settledScout"):
-            continue
-        if a.home is None or a.home is BOTTOM:
-            continue
-        if a.parentPort is None or a.parentPort is BOTTOM:
-            continue
-        u = int(a.home) if str(a.home).isdigit() else a.home
-        v = _port_neighbor(G, u, a.parentPort)
-        key = (min(u, v), max(u, v))
-        if key in seen:
-            continue
-        seen.add(key)
-        edges.append({
-            "u": str(u),
-            "v": str(v),
-            "srcPort": a.parentPort,
-            "dstPort": _port(G, v, u),
-        })
-    return edges
-
-def _snapshot(label, G, agents, round_number, agent_id=-1):
-    # print(label)
-    arr = [agents[k] for k in sorted(agents.keys())]
-    cur_positions = [[str(a.node)] for a in arr]
-    cur_statuses = [[str(a.state)] for a in arr]
-    cur_homes = [[str(a.home)] for a in arr]
-    cur_tree_edges = _compute_tree_edges(G, arr)
-    simmer.rounds = len(simmer.all_positions)
-
-    def _agent_index_in_arr(aid):
-        for i, a in enumerate(arr):
-            if a.ID == aid:
-                return i
-
-    def _get_agent_value(container, aid):
-        if isinstance(container, dict):
-            return container[aid]
-        if isinstance(container, (list, tuple)):
-            idx = _agent_index_in_arr(aid)
-            return container[idx]
-
-    def _set_agent_value(container, aid, value):
-        if isinstance(container, dict):
-            container[aid] = value
-            return container
-        if isinstance(container, list):
-            idx = _agent_index_in_arr(aid)
-            container[idx] = value
-            return container
-        if isinstance(container, tuple):
-            tmp = list(container)
-            idx = _agent_index_in_arr(aid)
-            tmp[idx] = value
-            return tuple(tmp)
-
-    def _update_label_at(idx, new_label):
-        simmer.all_positions[idx]   = (new_label, simmer.all_positions[idx][1])
-        simmer.all_statuses[idx]    = (new_label, simmer.all_statuses[idx][1])
-        simmer.all_node_states[idx] = (new_label, simmer.all_node_states[idx][1])
-        simmer.all_homes[idx]     = (new_label, simmer.all_homes[idx][1])
-        simmer.all_tree_edges[idx]      = (new_label, simmer.all_tree_edges[idx][1])
-
-    def _insert_new_round(new_label, base_positions, base_statuses, base_node_states, base_homes, base_tree_edges):
-        simmer.all_positions.append((new_label, base_positions))
-        simmer.all_statuses.append((new_label, base_statuses))
-        simmer.all_node_states.append((new_label, base_node_states))
-        simmer.all_homes.append((new_label, base_homes))
-        simmer.all_tree_edges.append((new_label, base_tree_edges))
-        simmer.rounds = len(simmer.all_positions)
-    
-    if round_number > simmer.rounds:
-        raise ValueError(f"round_number={round_number} > simmer.rounds={simmer.rounds}")
-
-    if agent_id == -1:
-        if round_number < simmer.rounds:
-            _update_label_at(round_number, label)
-            simmer.all_tree_edges[round_number]  = (label, cur_tree_edges)
-        elif round_number == simmer.rounds:
-            base_positions = copy.deepcopy(cur_positions)
-            base_statuses = copy.deepcopy(cur_statuses)
-            base_node_states = []
-            base_homes = copy.deepcopy(cur_homes)
-            base_tree_edges = copy.deepcopy(cur_tree_edges)
-            _insert_new_round(label, base_positions, base_statuses, base_node_states, base_homes, base_tree_edges)
-        return
-    
-    if round_number < simmer.rounds:
-        _update_label_at(round_number, label)
-        stored_positions = copy.deepcopy(simmer.all_positions[round_number][1])
-        stored_statuses  = copy.deepcopy(simmer.all_statuses[round_number][1])
-        stored_homes  = copy.deepcopy(simmer.all_homes[round_number][1])
-        new_agent_pos = _get_agent_value(cur_positions, agent_id)
-        new_agent_sta = _get_agent_value(cur_statuses, agent_id)
-        new_agent_hom = _get_agent_value(cur_homes, agent_id)
-        stored_positions = _set_agent_value(stored_positions, agent_id, new_agent_pos)
-        stored_statuses  = _set_agent_value(stored_statuses, agent_id, new_agent_sta)
-        stored_homes  = _set_agent_value(stored_homes, agent_id, new_agent_hom)
-        simmer.all_positions[round_number] = (label, stored_positions)
-        simmer.all_statuses[round_number]  = (label, stored_statuses)
-        simmer.all_homes[round_number]  = (label, stored_homes)
-        simmer.all_tree_edges[round_number]  = (label, cur_tree_edges)
-
-    elif round_number == simmer.rounds:
-        base_positions   = copy.deepcopy(cur_positions)
-        base_statuses    = copy.deepcopy(cur_statuses)
-        base_node_states = []
-        base_homes       = copy.deepcopy(cur_homes)
-        base_tree_edges = copy.deepcopy(cur_tree_edges)
-        new_agent_pos = _get_agent_value(cur_positions, agent_id)
-        new_agent_sta = _get_agent_value(cur_statuses, agent_id)
-        new_agent_hom = _get_agent_value(cur_homes, agent_id)
-        base_positions = _set_agent_value(base_positions, agent_id, new_agent_pos)
-        base_statuses  = _set_agent_value(base_statuses, agent_id, new_agent_sta)
-        base_homes  = _set_agent_value(base_homes, agent_id, new_agent_hom)
-        _insert_new_round(label, base_positions, base_statuses, base_node_states, base_homes, base_tree_edges)
-
-    
-
-class Agent:
+    def start(self, agents):
+        self.clearr()
+        self.order = [agents[k] for k in sorted(agents.keys())]
+        self.index = {a.ID: i for i, a in enumerate(self.order)}
+        self._cur = [(_UNSET, _UNSET, _UNSET)] * len(self.order)
+
+    def _observe(self, i, a):
+        vals = (a.node, a.state, a.home)
+        if vals != self._cur[i]:
+            self._cur[i] = vals
+            self._pending.append((i,) + vals)
+        return vals
+
+    def open_round(self, label):
+        for i, a in enumerate(self.order):
+            self._observe(i, a)
+        r = self.rounds
+        self.deltas.append(self._pending)
+        self._pending = []
+        self.patches.append([])
+        self.labels.append(label)
+        self.tree_versions.append(self.tree.version)
+        if r % self.keyframe_every == 0:
+            cur = self._cur
+            self.keyframes[r] = ([c[0] for c in cur], [c[1] for c in cur], [c[2] for c in cur])
+        self.rounds = r + 1
+
+    def wants(self, r):
+        """Whether a snapshot for round r is kept at the current trace level."""
+        if self.level == TRACE_MOVE:
+            return True
+        # "round" keeps only round openings, "final"/"none" nothing mid-run
+        return self.level == TRACE_ROUND and r == self.rounds
+
+    def snapshot(self, label, round_number, agent_id=-1):
+        """Record `label` at round_number; with agent_id, also that agent's state."""
+        if not self.wants(round_number):
+            return
+        if round_number > self.rounds:
+            raise ValueError(f"round_number={round_number} > rounds={self.rounds}")
+        if round_number == self.rounds:
+            self.open_round(label)
+            return
+        self.relabel(round_number, label)
+        if agent_id != -1:
+            self.record_agent(round_number, agent_id)
+
+    def snapshot_group(self, label, round_number, agent_ids):
+        """Record a group move as one event, with every member's new state."""
+        if not self.wants(round_number):
+            return
+        opened = round_number == self.rounds
+        self.snapshot(label, round_number)
+        if not opened:
+            for aid in agent_ids:
+                self.record_agent(round_number, aid)
+
+    def record_agent(self, r, agent_id):
+        i = self.index[agent_id]
+        self.patches[r].append((i,) + self._observe(i, self.order[i]))
+
+    def relabel(self, r, label):
+        self.labels[r] = label
+        self.tree_versions[r] = self.tree.version
+
+    @staticmethod
+    def _apply(frame, changes):
+        nodes, states, homes = frame
+        for i, node, state, home in changes:
+            nodes[i] = node
+            states[i] = state
+            homes[i] = home
+
+    def frame(self, r):
+        """(nodes, states, homes) lists of round r, indexed like `order`."""
+        if r < 0:
+            r += self.rounds
+        if not 0 <= r < self.rounds:
+            raise IndexError(r)
+        kf = r - r % self.keyframe_every
+        frame = tuple(list(x) for x in self.keyframes[kf])
+        for rr in range(kf + 1, r + 1):
+            self._apply(frame, self.deltas[rr])
+        self._apply(frame, self.patches[r])
+        return frame
+
+    def frames(self):
+        """Yield every frame in order, replaying deltas once."""
+        base = ([], [], [])
+        for r in range(self.rounds):
+            if r in self.keyframes:
+                base = tuple(list(x) for x in self.keyframes[r])
+            else:
+                self._apply(base, self.deltas[r])
+            frame = tuple(list(x) for x in base)
+            self._apply(frame, self.patches[r])
+            yield frame
+
+    @property
+    def all_positions(self):
+        return _FrameView(self, lambda r, f: [[str(x)] for x in f[0]])
+
+    @property
+    def all_statuses(self):
+        return _FrameView(self, lambda r, f: [[str(x)] for x in f[1]])
+
+    @property
+    def all_node_states(self):
+        return _FrameView(self, lambda r, f: [])
+
+    @property
+    def all_homes(self):
+        return _FrameView(self, lambda r, f: [[str(x)] for x in f[2]])
+
+    @property
+    def all_tree_edges(self):
+        return _FrameView(self, lambda r, f: self.tree.edges(self.tree_versions[r]))
+
+
+class _FrameView(Sequence):
+    """Read-only ``[(label, data), ...]`` view over a Recorder trace."""
+    def __init__(self, trace, render):
+        self._trace = trace
+        self._render = render
+
+    def __len__(self):
+        return self._trace.rounds
+
+    def __getitem__(self, r):
+        if isinstance(r, slice):
+            return [self[i] for i in range(*r.indices(len(self)))]
+        if r < 0:
+            r += len(self)
+        return (self._trace.labels[r], self._render(r, self._trace.frame(r)))
+
+    def __iter__(self):
+        for r, frame in enumerate(self._trace.frames()):
+            yield (self._trace.labels[r], self._render(r, frame))
+
+    def __eq__(self, other):
+        if not isinstance(other, Sequence):
+            return NotImplemented
+        return list(self) == list(other)
+
+AGENT_STATES = ("unsettled", "settled", "settledScout")
+# what rooted_async is doing, for Metrics; moves are booked to Engine.phase
+PHASES = ("settle", "probe", "vacate", "forward", "backtrack", "shortcut", "retrace", "relocate")
+NODE_TYPES = ("unvisited", "visited", "partiallyVisited", "fullyVisited")
+
+
+class Agent(AgentView):
+    """A help-by-scouts agent: a __slots__ view onto its row of an AgentStore.
+
+    The Engine adopts the agents into a store when a run starts; until then
+    the fields live in the view itself.
+    """
+    __slots__ = ("ID", "group")  # the ID never changes and is read constantly: kept on the view
+
+    _node = IntField(column="node")
+    state = EnumField(AGENT_STATES)
+    _arrivalPort = IntField(column="arrivalPort")
+    treeLabel = Field()
+
+    nodeType = EnumField(NODE_TYPES)
+    parentID = IntField()
+    parentPort = IntField()
+    portAtParent = IntField()
+    P1Neighbor = IntField()
+    portAtP1Neighbor = IntField()
+    vacatedNeighbor = BoolField()
+    recentChild = IntField()
+    sibling = Field()  # (agent ID, port) or None
+    recentPort = IntField()
+    probeResult = Field()
+    checked = IntField()
+
+    scoutPort = IntField()
+    scoutEdgeType = EnumField((None,) + graph_utils.EDGE_TYPES)
+    scoutP1Neighbor = IntField()
+    scoutPortAtP1Neighbor = IntField()
+    scoutP1P1Neighbor = IntField()
+    scoutPortAtP1P1Neighbor = IntField()
+    scoutResult = Field()
+
+    prevID = IntField()
+    childPort = IntField()
+    siblingDetails = Field()
+    childDetails = Field()
+    nextAgentID = IntField()
+    nextPort = IntField()
+
+    home = IntField()
+    returnPort = IntField()
+    returnreturnPort = IntField()
+    returnreturnreturnPort = IntField()
+    probeResultsByPort = Field(factory=dict)
+    _moves = IntField(column="moves", dtype="int64")
+
     def __init__(self, id: int, start_node: int):
+        super().__init__()
 
+        self.group = None  # the Group this agent currently moves with
         self.node = start_node
 
         self.ID = id
@@ -188,33 +387,89 @@ class Agent:
         self.returnreturnPort = BOTTOM
         self.returnreturnreturnPort = BOTTOM
         self.probeResultsByPort = {}
+        self.moves = 0
+
+    # node, arrivalPort and moves are shared with the group while in one
+
+    @property
+    def node(self):
+        return self._node if self.group is None else self.group.node
+
+    @node.setter
+    def node(self, node):
+        self._node = node
+
+    @property
+    def arrivalPort(self):
+        return self._arrivalPort if self.group is None else self.group.arrivalPort
+
+    @arrivalPort.setter
+    def arrivalPort(self, port):
+        self._arrivalPort = port
+
+    @property
+    def moves(self):
+        return self._moves if self.group is None else self._moves + self.group.moves
+
+    @moves.setter
+    def moves(self, moves):
+        self._moves = moves if self.group is None else moves - self.group.moves
 
     @property
     def aid(self) -> int:
         return self.ID
 
 
-def _port(G, u, v):
-    return G[u][v][f"port_{u}"]
+class Group:
+    """Co-located agents that move together as one unit.
+
+    Members read node, arrivalPort and moves through the group, so moving
+    it is O(1) whatever its size. An agent that moves on its own is detached
+    first, getting its own copy of those fields back.
+    """
+    __slots__ = ("node", "arrivalPort", "moves", "members", "settled_by_home")
+
+    def __init__(self):
+        self.node = None
+        self.arrivalPort = BOTTOM
+        self.moves = 0
+        self.members = set()
+        self.settled_by_home = {}  # home (or _ANYWHERE) -> settled member IDs, see Engine.reindex
+
+    def attach(self, a):
+        if not self.members:
+            self.node, self.arrivalPort = a.node, a.arrivalPort
+        a._moves -= self.moves
+        a.group = self
+        self.members.add(a.ID)
+
+    def detach(self, a):
+        a._node, a._arrivalPort = self.node, self.arrivalPort
+        a._moves += self.moves
+        a.group = None
+        self.members.discard(a.ID)
+
 
 def _port_neighbor(G, u, port=PORT_ONE):
-    pm = G.nodes[u]["port_map"]
-    if (port not in pm.keys()):
-        raise RuntimeError(f"tried to access port {port} at node {u}, ports = {pm.keys()}")
-    return pm[port]
-
-def edge_type(G, u, v):
-    puv = _port(G, u, v)
-    pvu = _port(G, v, u)
-    u_is_1 = (puv == PORT_ONE)
-    v_is_1 = (pvu == PORT_ONE)
-    if u_is_1 and v_is_1:
-        return "t11"
-    if (not u_is_1) and v_is_1:
-        return "tp1"
-    if u_is_1 and (not v_is_1):
-        return "t1q"
-    return "tpq"
+    v = G.neighbor(u, port)
+    if v is None:
+        raise RuntimeError(f"tried to access port {port} at node {u}, ports = {list(range(G.degree(u)))}")
+    return v
+
+def _hop(G, u, port):
+    # (node behind port of u, port back to u)
+    if port == PORT_ONE:
+        v, back = G.p1_neighbor(u)
+    else:
+        v = G.neighbor(u, port)
+        back = G.reverse_port(u, port) if v is not None else None
+    if v is None:
+        raise RuntimeError(f"tried to access port {port} at node {u}, ports = {list(range(G.degree(u)))}")
+    return v, back
+
+def edge_type(G, u, puv):
+    # type of the edge leaving u through port puv: t11 / tp1 / t1q / tpq
+    return G.edge_type(u, puv)
 
 def _edge_rank(edge_type: str) -> int:
     if edge_type == "tp1":
@@ -230,21 +485,22 @@ def update_node_type_after_probe(G, x, psi_x, scout_results):
         psi_x.nodeType = "fullyVisited"
         return
     if psi_x.parentPort is not None:
-        parent_node = _port_neighbor(G, x, psi_x.parentPort)
-        parent_edge_type = edge_type(G, x, parent_node)
+        parent_edge_type = edge_type(G, x, psi_x.parentPort)
         if parent_edge_type == "tpq" and all(r[1] == "tpq" for r in empty):
             psi_x.nodeType = "partiallyVisited"
             return
     psi_x.nodeType = "visited"
 
 
-def reconfigure_if_needed(agents, psi_x, port_to_w, psi_w, arrival_port_at_w):
+def reconfigure_if_needed(eng, psi_x, port_to_w, psi_w, arrival_port_at_w):
     if psi_w.nodeType == "partiallyVisited" and arrival_port_at_w == PORT_ONE:
         psi_w.parentID = psi_x.ID
-        print(f"[DBG_RECONF] psi_w={psi_w.ID}@{psi_w.node} NEW parent={psi_w.parentID} parentPort={psi_w.parentPort}")
+        if eng.events.active:
+            eng.events.emit("reconfigure", agent=psi_w.ID, node=psi_w.node, parent=psi_w.parentID, parentPort=psi_w.parentPort)
         psi_w.portAtParent = port_to_w 
         psi_w.parentPort = arrival_port_at_w  ################
         psi_w.nodeType = "visited"
+        eng.changed(psi_w)
 
 def _candidate_rank(scout_result):
     pxy, etype, ntype, _ = scout_result
@@ -259,107 +515,132 @@ def _candidate_rank(scout_result):
     return (node_rank, _edge_rank(etype), pxy) 
 
 
-def _xi_id(G, w, exclude_ids=None, agents=None):
+def _xi_id(eng, w, exclude_ids=()):
     # returns the ID of an agent settled at w else none
-    exclude_ids = exclude_ids or set()
-    agents_here = [aid for aid in G.nodes[w]["agents"] if ((aid not in exclude_ids) and ((agents[aid].state=="settled") or (agents[aid].state=="settledScout" and agents[aid].home==w)))]
-    return agents_here[0] if agents_here else None
-
-
-def _move_agent(G, agents, agent_id, from_node, out_port, round_number):
-    if agents[agent_id].node != from_node:
-        raise RuntimeError(f"Agent {agent_id} not at {from_node}, at {agents[agent_id].node}")
-    to_node = _port_neighbor(G, from_node, out_port)
-    if to_node is None:
-        raise ValueError(f"Invalid port {out_port} at node {from_node}")
-
-    G.nodes[from_node]["agents"].discard(agent_id)
-    G.nodes[to_node]["agents"].add(agent_id)
-
-    a = agents[agent_id]
+    for aid in eng.settled_at.get(w, ()):
+        if aid not in exclude_ids:
+            return aid
+    g = eng.group
+    if g.members and g.node == w:
+        for key in (w, _ANYWHERE):
+            for aid in g.settled_by_home.get(key, ()):
+                if aid not in exclude_ids:
+                    return aid
+    return None
+
+
+def _move_agent(eng, agent_id, from_node, out_port, round_number):
+    a = eng.agents[agent_id]
+    if a.node != from_node:
+        raise RuntimeError(f"Agent {agent_id} not at {from_node}, at {a.node}")
+    to_node, in_port = _hop(eng.G, from_node, out_port)
+
+    if a.group is not None:
+        eng.stray(a)
     a.node = to_node
-    a.arrivalPort = _port(G, to_node, from_node)
+    a.arrivalPort = in_port
+    a.moves += 1
+    eng.reindex(a)
+    eng.metrics.moves[eng.phase] += 1
 
-    _snapshot(f"move_agent(a={agent_id},from={from_node},p={out_port},to={to_node})", G, agents, round_number, agent_id)
+    if eng.rec.wants(round_number):
+        eng.rec.snapshot(f"move_agent(a={agent_id},from={from_node},p={out_port},to={to_node})", round_number, agent_id)
 
-    in_port = G[to_node][from_node][f"port_{to_node}"]
     return to_node, in_port
 
 
-def _move_group(G, agents, agent_ids, from_node, out_port, round_number):
-    to_node = _port_neighbor(G, from_node, out_port)
-
-    for aid in list(agent_ids):
-        _move_agent(G, agents, aid, from_node, out_port, round_number)
-
-    _snapshot(f"move_group(from={from_node},p={out_port},to={to_node},|A|={len(agent_ids)})", G, agents, round_number)
-    return to_node
-
-
-def can_vacate(G, agents: List["Agent"], x, psi_x, A_vacated, round_number):
-    _snapshot(f"can_vacate:enter(x={x}, psi={psi_x.ID})", G, agents, round_number)
+def _move_group(eng, agent_ids, from_node, out_port, round_number):
+    G = eng.G
+    if agent_ids is not eng.scouts:
+        to_node = _port_neighbor(G, from_node, out_port)
+        for aid in list(agent_ids):
+            _move_agent(eng, aid, from_node, out_port, round_number)
+        if eng.rec.wants(round_number):
+            eng.rec.snapshot(f"move_group(from={from_node},p={out_port},to={to_node},|A|={len(agent_ids)})", round_number)
+        return to_node
+
+    # the scouts travel as eng.group: one hop for all of them
+    g = eng.gather(from_node)
+    g.node, g.arrivalPort = _hop(G, from_node, out_port)
+    g.moves += 1
+    eng.metrics.moves[eng.phase] += len(agent_ids)
+    if eng.rec.wants(round_number):
+        eng.rec.snapshot_group(f"move_group(from={from_node},p={out_port},to={g.node},|A|={len(agent_ids)})", round_number, agent_ids)
+    return g.node
+
+
+def can_vacate(eng, x, psi_x, round_number):
+    agents = eng.agents
+    eng.phase = "vacate"
+    eng.rec.snapshot(f"can_vacate:enter(x={x}, psi={psi_x.ID})", round_number)
     round_number+=1
 
     if psi_x.parentPort is None:
-        _snapshot(f"can_vacate:exit(x={x})", G, agents, round_number)
+        eng.rec.snapshot(f"can_vacate:exit(x={x})", round_number)
         return "settled", 2
 
     if ((psi_x.nodeType == "visited") or ((psi_x.nodeType == "fullyVisited") and (psi_x.vacatedNeighbor is False))):
-        w, p_wx = _move_agent(G, agents, psi_x.ID, x, PORT_ONE, round_number)
-        xi_w_id = _xi_id(G, w, {psi_x.ID}, agents)
+        w, p_wx = _move_agent(eng, psi_x.ID, x, PORT_ONE, round_number)
+        xi_w_id = _xi_id(eng, w, {psi_x.ID})
         if xi_w_id is not None:
             psi_w_id = xi_w_id
             agents[psi_w_id].vacatedNeighbor = True
-            psi_x.portAtP1Neighbor = p_wx
-            psi_x.P1Neighbor = psi_w_id
-            _move_agent(G, agents, psi_x.ID, w, p_wx,round_number+1)
-            _snapshot(f"can_vacate:exit(x={x})", G, agents, round_number+2)
+            eng.set_p1_neighbor(psi_x, psi_w_id, p_wx)
+            _move_agent(eng, psi_x.ID, w, p_wx,round_number+1)
+            eng.rec.snapshot(f"can_vacate:exit(x={x})", round_number+2)
             return "settledScout", 4
-        _move_agent(G, agents, psi_x.ID, w, p_wx, round_number+1)
-        _snapshot(f"can_vacate:exit(x={x})", G, agents, round_number+2)
+        _move_agent(eng, psi_x.ID, w, p_wx, round_number+1)
+        eng.rec.snapshot(f"can_vacate:exit(x={x})", round_number+2)
         return "settled", 4
 
     if psi_x.nodeType == "partiallyVisited":
-        _snapshot(f"can_vacate:exit(x={x})", G, agents, round_number)
+        eng.rec.snapshot(f"can_vacate:exit(x={x})", round_number)
         return "settledScout", 2
 
     if psi_x.portAtParent == PORT_ONE:
-        z, _ = _move_agent(G, agents, psi_x.ID, x, psi_x.parentPort, round_number)
-        psi_z_id = _xi_id(G, z, {psi_x.ID}, agents)
+        z, _ = _move_agent(eng, psi_x.ID, x, psi_x.parentPort, round_number)
+        psi_z_id = _xi_id(eng, z, {psi_x.ID})
         if psi_z_id is None:  ################
-            _move_agent(G, agents, psi_x.ID, z, psi_x.portAtParent, round_number+1)  ################
-            _snapshot(f"can_vacate:exit(x={x})", G, agents, round_number+2)  ################
+            _move_agent(eng, psi_x.ID, z, psi_x.portAtParent, round_number+1)  ################
+            eng.rec.snapshot(f"can_vacate:exit(x={x})", round_number+2)  ################
             return "settled", 4  ################
         psi_z = agents[psi_z_id]
         if psi_z.vacatedNeighbor==False:
             psi_z.state = "settledScout"
-            psi_z.portAtP1Neighbor = psi_x.parentPort
-            psi_z.P1Neighbor = psi_x.ID
-            A_vacated.add(psi_z.ID)
-            _move_group(G, agents, {psi_x.ID, psi_z.ID}, z, psi_x.portAtParent, round_number+1)
+            eng.changed(psi_z)
+            if eng.events.active:
+                eng.events.emit("vacate", agent=psi_z.ID, node=z)
+            eng.set_p1_neighbor(psi_z, psi_x.ID, psi_x.parentPort)
+            eng.mark_vacated(psi_z.ID)
+            _move_group(eng, {psi_x.ID, psi_z.ID}, z, psi_x.portAtParent, round_number+1)
             psi_x.vacatedNeighbor = True
-            _snapshot(f"can_vacate:exit(x={x})", G, agents, round_number+2)
+            eng.rec.snapshot(f"can_vacate:exit(x={x})", round_number+2)
             return "settled", 4
         else:
-            _move_agent(G, agents, psi_x.ID, z, psi_x.portAtParent, round_number+1)
-            _snapshot(f"can_vacate:exit(x={x})", G, agents, round_number+2)
+            _move_agent(eng, psi_x.ID, z, psi_x.portAtParent, round_number+1)
+            eng.rec.snapshot(f"can_vacate:exit(x={x})", round_number+2)
             return "settled", 4
         
-    _snapshot(f"can_vacate:exit(x={x})", G, agents, round_number)
+    eng.rec.snapshot(f"can_vacate:exit(x={x})", round_number)
     return "settled", 2
 
 
-def parallel_probe(G, agents: List["Agent"], x, psi_x, A_scout, round_number_og_og):
-    _snapshot(f"parallel_probe:enter(x={x})", G, agents, round_number_og_og)
+def parallel_probe(eng, x, psi_x, A_scout, round_number_og_og):
+    G, agents = eng.G, eng.agents
+    if eng.events.active:
+        eng.events.emit("probe-start", node=x, agent=psi_x.ID, scouts=len(A_scout))
+    eng.phase = "probe"
+    eng.rec.snapshot(f"parallel_probe:enter(x={x})", round_number_og_og)
     round_number_og_og+=1
 
     psi_x.probeResultsByPort = {}
     psi_x.probeResult = None
     psi_x.checked = 0
-    delta_x = G.degree[x]
+    delta_x = G.degree(x)
     rounds_max = 0
+    passes = 0
     while psi_x.checked < delta_x:
-        A_scout = sorted(A_scout)
+        passes += 1
         s = len(A_scout)
         Delta_prime = min(s, delta_x - psi_x.checked)
         j = 0
@@ -374,56 +655,56 @@ def parallel_probe(G, agents: List["Agent"], x, psi_x, A_scout, round_number_og_
                 continue
             a = agents[A_scout[jk]]
             a.scoutPort = port
-            y, a.returnPort = _move_agent(G, agents, a.ID, x, a.scoutPort, round_number)
+            y, a.returnPort = _move_agent(eng, a.ID, x, a.scoutPort, round_number)
             round_number+=1
-            a.scoutEdgeType = edge_type(G, x, y)
-            xi_y_id = _xi_id(G, y, set(A_scout), agents)
+            a.scoutEdgeType = edge_type(G, x, a.scoutPort)
+            xi_y_id = _xi_id(eng, y, A_scout)
             if xi_y_id is not None:
                 psi_y_id = xi_y_id
-                _move_agent(G, agents, a.ID, y, a.returnPort, round_number)
+                _move_agent(eng, a.ID, y, a.returnPort, round_number)
                 round_number+=1
             else:
                 if False:
                     pass
                 else:
-                    z, a.returnreturnPort = _move_agent(G, agents, a.ID, y, PORT_ONE, round_number)
+                    z, a.returnreturnPort = _move_agent(eng, a.ID, y, PORT_ONE, round_number)
                     round_number+=1
-                    xi_z_id = _xi_id(G, z, set(A_scout), agents)
+                    xi_z_id = _xi_id(eng, z, A_scout)
                     if xi_z_id is not None:
-                        _move_agent(G, agents, a.ID, z, a.returnreturnPort, round_number)
-                        _move_agent(G, agents, a.ID, y, a.returnPort, round_number+1)
+                        _move_agent(eng, a.ID, z, a.returnreturnPort, round_number)
+                        _move_agent(eng, a.ID, y, a.returnPort, round_number+1)
                         round_number+=2
-                        b_id = next((bid for bid in A_scout if agents[bid].P1Neighbor == xi_z_id and agents[bid].portAtP1Neighbor == G[z][y][f"port_{z}"]), None)
+                        b_id = eng.p1_back_id(xi_z_id, a.returnreturnPort, A_scout)
                         if b_id is not None:
                             psi_y_id = b_id
                         else:
                             psi_y_id = None
                     else:
-                        if (G[z][y][f"port_{z}"]==PORT_ONE):
+                        if (a.returnreturnPort==PORT_ONE):
                             psi_y_id = None
-                            _move_agent(G, agents, a.ID, z, a.returnreturnPort, round_number)
-                            _move_agent(G, agents, a.ID, y, a.returnPort, round_number+1)
+                            _move_agent(eng, a.ID, z, a.returnreturnPort, round_number)
+                            _move_agent(eng, a.ID, y, a.returnPort, round_number+1)
                             round_number+=2
                         else:
-                            w, a.returnreturnreturnPort = _move_agent(G, agents, a.ID, z, PORT_ONE, round_number)
+                            w, a.returnreturnreturnPort = _move_agent(eng, a.ID, z, PORT_ONE, round_number)
                             round_number+=1
-                            xi_w_id = _xi_id(G, w, set(A_scout), agents)
-                            a.scoutP1P1Neighbor = _xi_id(G, w, set(A_scout), agents)
-                            a.scoutPortAtP1P1Neighbor = G[w][z][f"port_{w}"]
-                            if _xi_id(G, w, set(A_scout), agents) is None:
-                                _move_agent(G, agents, a.ID, w, a.returnreturnreturnPort, round_number)
-                                _move_agent(G, agents, a.ID, z, a.returnreturnPort, round_number+1)
-                                _move_agent(G, agents, a.ID, y, a.returnPort, round_number+2)
+                            xi_w_id = _xi_id(eng, w, A_scout)
+                            a.scoutP1P1Neighbor = xi_w_id
+                            a.scoutPortAtP1P1Neighbor = a.returnreturnreturnPort
+                            if xi_w_id is None:
+                                _move_agent(eng, a.ID, w, a.returnreturnreturnPort, round_number)
+                                _move_agent(eng, a.ID, z, a.returnreturnPort, round_number+1)
+                                _move_agent(eng, a.ID, y, a.returnPort, round_number+2)
                                 round_number+=3
                                 psi_y_id = None
                             else:
-                                _move_agent(G, agents, a.ID, w, a.returnreturnreturnPort, round_number)
-                                _move_agent(G, agents, a.ID, z, a.returnreturnPort, round_number+1)
-                                _move_agent(G, agents, a.ID, y, a.returnPort, round_number+2)
+                                _move_agent(eng, a.ID, w, a.returnreturnreturnPort, round_number)
+                                _move_agent(eng, a.ID, z, a.returnreturnPort, round_number+1)
+                                _move_agent(eng, a.ID, y, a.returnPort, round_number+2)
                                 round_number+=3
-                                c_id = next((cid for cid in A_scout if agents[cid].P1Neighbor == xi_w_id and agents[cid].portAtP1Neighbor == G[w][z][f"port_{w}"]), None)
+                                c_id = eng.p1_back_id(xi_w_id, a.returnreturnreturnPort, A_scout)
                                 if c_id is not None:
-                                    b_id = next((bid for bid in A_scout if agents[bid].P1Neighbor == c_id and agents[bid].portAtP1Neighbor == G[z][y][f"port_{z}"]), None)
+                                    b_id = eng.p1_back_id(c_id, a.returnreturnPort, A_scout)
                                     if b_id is not None:
                                         psi_y_id = b_id
                                     else:
@@ -431,8 +712,14 @@ def parallel_probe(G, agents: List["Agent"], x, psi_x, A_scout, round_number_og_
                                 else:
                                     psi_y_id = None
 
-            a.scoutResult = (G[x][y][f"port_{x}"], a.scoutEdgeType, (agents[psi_y_id].nodeType if psi_y_id is not None else "unvisited"), psi_y_id)
-            psi_x.probeResultsByPort[G[x][y][f"port_{x}"]] = a.scoutResult
+            if psi_y_id is None:
+                y_type = "unvisited"
+            elif psi_y_id in eng.own:
+                y_type = agents[psi_y_id].nodeType
+            else:
+                y_type = "foreign"  # settled by another DFS (general mode): never a candidate
+            a.scoutResult = (a.scoutPort, a.scoutEdgeType, y_type, psi_y_id)
+            psi_x.probeResultsByPort[a.scoutPort] = a.scoutResult
             j+=1
             jk+=1
             rounds_max = max(rounds_max, round_number-round_number_og_og)
@@ -445,30 +732,43 @@ def parallel_probe(G, agents: List["Agent"], x, psi_x, A_scout, round_number_og_
         else:
             psi_x.probeResult = best
 
-    _snapshot(f"parallel_probe:exit", G, agents, round_number_og_og+rounds_max)
+    eng.metrics.probe_passes[x] += passes
+    eng.rec.snapshot(f"parallel_probe:exit", round_number_og_og+rounds_max)
     return (psi_x.probeResult[0] if psi_x.probeResult is not None else None), (rounds_max+2)
 
 
-def retrace(G, agents, A_vacated, round_number, max_rounds):
-    _snapshot("retrace:enter", G, agents, round_number)
-    round_number+=1
-    siblingDetails = None
-    nextAgentID = None
-    nextPort = None
+def retrace(eng, round_number, max_rounds, root_node=None, at=None):
+    # `at` = (round_number, siblingDetails, nextAgentID, nextPort) resumes a
+    # checkpoint taken at the top of the loop; root_node is only recorded
+    # in checkpoints
+    agents = eng.agents
+    A_vacated = eng.vacated
+    eng.phase = "retrace"
+    if at is None:
+        eng.rec.snapshot("retrace:enter", round_number)
+        round_number+=1
+        eng.metrics.rounds["retrace"] += 1
+        siblingDetails = None
+        nextAgentID = None
+        nextPort = None
+    else:
+        round_number, siblingDetails, nextAgentID, nextPort = at
     while A_vacated:
+        eng.maybe_checkpoint(root_node, ("retrace", round_number, siblingDetails, nextAgentID, nextPort), max_rounds)
         if round_number>max_rounds:
             raise RuntimeError("Round limit exceeded in retrace")
-        amin_id = min(A_vacated)
+        amin_id = A_vacated.min()
         amin = agents[amin_id]
         v = amin.node
-        xi_v_id = _xi_id(G, v, set(), agents)
+        xi_v_id = _xi_id(eng, v)
         psi_v_id = xi_v_id
         if xi_v_id is None:
             target_id = nextAgentID
             a = agents[target_id]
             a.state = "settled"
-            A_vacated.discard(target_id)
-            amin_id = min(A_vacated)
+            eng.changed(a)
+            eng.unmark_vacated(target_id)
+            amin_id = A_vacated.min()
             amin = agents[amin_id]
             psi_v_id = a.ID
 
@@ -490,11 +790,7 @@ def retrace(G, agents, A_vacated, round_number, max_rounds):
                     psi_v.recentChild = nextPort
             else:
                 nextPort = psi_v.recentChild
-                found = None
-                for aid in A_vacated:
-                    if (agents[aid].parentID, agents[aid].portAtParent) == (psi_v.ID, psi_v.recentChild):
-                        found = aid
-                        break
+                found = eng.child_id(psi_v.ID, psi_v.recentChild, A_vacated)
                 if found is not None:
                     nextAgentID = found
                     nextPort = psi_v.recentChild
@@ -504,36 +800,63 @@ def retrace(G, agents, A_vacated, round_number, max_rounds):
             nextPort = psi_v.parentPort
             siblingDetails = psi_v.sibling
 
-        A_vacated.discard(psi_v.ID)
+        eng.unmark_vacated(psi_v.ID)
         psi_v.state = "settled"
-        _move_group(G, agents, A_vacated, v, nextPort, round_number)
+        eng.changed(psi_v)
+        if eng.events.active:
+            eng.events.emit("retrace-step", node=v, port=nextPort, agents=len(A_vacated))
+        _move_group(eng, eng.scouts, v, nextPort, round_number)  # A_unsettled is empty, so these are A_vacated
         round_number+=1
+        eng.metrics.rounds["retrace"] += 1
 
-    _snapshot("retrace:exit", G, agents, round_number)
+    eng.rec.snapshot("retrace:exit", round_number)
     round_number+=1
+    eng.metrics.rounds["retrace"] += 1
     return round_number
 
 
-def rooted_async(G, agents, root_node, max_rounds):
-    _snapshot(f"rooted_async:enter(root={root_node})", G, agents, 0)
-    round_number = 1
-    A = set(agents.keys())
-    A_unsettled = set(A)
-    A_vacated = set()
-    siblingDetails = None
-    childDetails = None
+def rooted_async(eng, root_node, max_rounds, at=None):
+    steps = _dfs(eng, root_node, max_rounds, at)
+    while True:
+        try:
+            next(steps)
+        except StopIteration as done:
+            return done.value
+
+
+def _dfs(eng, root_node, max_rounds, at=None):
+    # rooted_async as a generator: yields the round number after every
+    # settle (and every relocation hop), when the DFS is at a settled node,
+    # so general_async can interleave several DFSs; returns the last round.
+    # `at` resumes a checkpoint taken at the top of a loop: ("dfs",
+    # round_number, siblingDetails, childDetails) here, or ("retrace", ...)
+    # in retrace.
+    G, agents, metrics = eng.G, eng.agents, eng.metrics
+    if at is None:
+        eng.rec.snapshot(f"rooted_async:enter(root={root_node})", 0)
+        round_number, siblingDetails, childDetails = 1, None, None
+    elif at[0] == "retrace":
+        round_number = retrace(eng, None, max_rounds, root_node, at[1:])
+        eng.rec.snapshot("rooted_async:exit", round_number)
+        return round_number
+    else:
+        round_number, siblingDetails, childDetails = at[1:]
+    A_unsettled, A_scout = eng.unsettled, eng.scouts
     while A_unsettled:
+        eng.maybe_checkpoint(root_node, ("dfs", round_number, siblingDetails, childDetails), max_rounds)
         if round_number>max_rounds:
             raise RuntimeError("Round limit exceeded in rooted async")
-        v = agents[min(A_unsettled | A_vacated)].node
-        A_scout = set(A_unsettled) | set(A_vacated)
-        amin = agents[min(A_scout)]
-        psi_v_id = _xi_id(G, v, {}, agents)
+        amin = agents[A_scout.min()]
+        v = amin.node
+        psi_v_id = _xi_id(eng, v)
         if psi_v_id is None:
-            candidates = [aid for aid in A_unsettled if agents[aid].node == v]
-            if not candidates:
-                raise RuntimeError(f"No unsettled agent at v={v} to settle (this breaks invariants).")
-            psi_v_id = max(candidates)
+            psi_v_id = A_unsettled.max() if A_unsettled else None
+            if psi_v_id is None or agents[psi_v_id].node != v:
+                # the unsettled agents normally travel together; look for stragglers
+                candidates = [aid for aid in A_unsettled if agents[aid].node == v]
+                if not candidates:
+                    raise RuntimeError(f"No unsettled agent at v={v} to settle (this breaks invariants).")
+                psi_v_id = max(candidates)
             psi_v = agents[psi_v_id]
             psi_v.state = "settled"
             psi_v.home = psi_v.node
@@ -556,46 +879,64 @@ def rooted_async(G, agents, root_node, max_rounds):
                 psi_v.parentID = amin.prevID
                 psi_v.portAtParent = amin.childPort
             amin.childPort = None
-            A_unsettled.remove(psi_v_id)
-            A_scout = set(A_unsettled) | set(A_vacated)
-            _snapshot(f"rooted_async:settled(psi={psi_v_id},v={v})", G, agents, round_number)
+            eng.changed(psi_v)
+            eng.mark_settled(psi_v_id)
+            if eng.events.active:
+                eng.events.emit("settle", agent=psi_v_id, node=v)
+            eng.rec.snapshot(f"rooted_async:settled(psi={psi_v_id},v={v})", round_number, psi_v_id)
             round_number+=1
+            metrics.rounds["settle"] += 1
             if not A_unsettled:
                 psi_v.sibling = siblingDetails
                 break
+        yield round_number
         psi_v = agents[psi_v_id]
         amin.prevID = psi_v.ID
-        k = len(A)
-        delta_v = G.degree[v]
+        k = len(agents)
+        delta_v = G.degree(v)
         if delta_v >= k - 1:
-            print("shortcut taken")
-            _, rounds_max = parallel_probe(G, agents, v, agents[psi_v_id], A_scout, round_number)
+            if eng.events.active:
+                eng.events.emit("shortcut", node=v, agents=len(A_unsettled))
+            metrics.shortcuts += 1
+            _, rounds_max = parallel_probe(eng, v, agents[psi_v_id], A_scout, round_number)
             round_number+=rounds_max
+            metrics.rounds["probe"] += rounds_max
+            eng.phase = "shortcut"
             probe_items = sorted(agents[psi_v_id].probeResultsByPort.items(), key=lambda kv: kv[0])
             empty_ports = [sr[0] for _, sr in probe_items[: (k - 1)] if sr and sr[3] is None]
-            movers = sorted(A_unsettled - {psi_v_id})
+            movers = [aid for aid in A_unsettled if aid != psi_v_id]
             if len(empty_ports) >= len(movers):
                 for aid, out_port in zip(movers, empty_ports):
-                    y, _ = _move_agent(G, agents, aid, v, out_port, round_number)
+                    y, _ = _move_agent(eng, aid, v, out_port, round_number)
                     agents[aid].state = "settled"
                     agents[aid].home = y
-                    A_unsettled.discard(aid)
+                    eng.changed(agents[aid])
+                    eng.mark_settled(aid)
+                    if eng.rec.wants(round_number):
+                        eng.rec.record_agent(round_number, aid)
+                    if eng.events.active:
+                        eng.events.emit("settle", agent=aid, node=y)
                 round_number+=1
+                metrics.rounds["shortcut"] += 1
                 break
 
-        nextPort, rounds_max = parallel_probe(G, agents, v, psi_v, A_scout, round_number)
+        nextPort, rounds_max = parallel_probe(eng, v, psi_v, A_scout, round_number)
         round_number+=rounds_max
+        metrics.rounds["probe"] += rounds_max
         scout_results = list(psi_v.probeResultsByPort.values())
         update_node_type_after_probe(G, v, psi_v, scout_results)
-        psi_v.state, rounds_max = can_vacate(G, agents, v, psi_v, A_vacated, round_number)
-        round_number+=rounds_max
-        if psi_v.state=="settled":
-            A_unsettled.discard(psi_v.ID)
-            A_vacated.discard(psi_v.ID)
-            A_scout = set(A_unsettled) | set(A_vacated)
-        if psi_v.state == "settledScout":
-            A_vacated.add(psi_v.ID)
-            A_scout = set(A_unsettled) | set(A_vacated)
+        if eng.rooted:
+            psi_v.state, rounds_max = can_vacate(eng, v, psi_v, round_number)
+            eng.changed(psi_v)
+            round_number+=rounds_max
+            metrics.rounds["vacate"] += rounds_max
+            if psi_v.state=="settled":
+                eng.mark_settled(psi_v.ID)
+                eng.unmark_vacated(psi_v.ID)
+            if psi_v.state == "settledScout":
+                eng.mark_vacated(psi_v.ID)
+                if eng.events.active:
+                    eng.events.emit("vacate", agent=psi_v.ID, node=v)
         
         if nextPort is not None:
             psi_v.recentPort = nextPort
@@ -608,52 +949,520 @@ def rooted_async(G, agents, root_node, max_rounds):
                 siblingDetails = childDetails
                 childDetails = None
                 psi_v.recentChild = nextPort
-            w = _move_group(G, agents, A_scout, v, nextPort, round_number)
-            _snapshot(f"rooted_async:move_forward(v={v},p={nextPort})", G, agents, round_number)
+            eng.phase = "forward"
+            w = _move_group(eng, A_scout, v, nextPort, round_number)
+            eng.rec.snapshot(f"rooted_async:move_forward(v={v},p={nextPort})", round_number)
             round_number+=1
-            # psi_w_id = _xi_id(G, w, exclude_ids=set(), agents=agents)
+            metrics.rounds["forward"] += 1
+            # psi_w_id = _xi_id(eng, w, exclude_ids=set())
             # if psi_w_id is not None:
             #     psi_w = agents[psi_w_id]
             #     arrival_port_at_w = amin.arrivalPort
-            #     reconfigure_if_needed(agents, psi_v, nextPort, psi_w, arrival_port_at_w)
+            #     reconfigure_if_needed(eng, psi_v, nextPort, psi_w, arrival_port_at_w)
         else:
             if psi_v.parentPort is None:
-                if A_unsettled:
+                if A_unsettled and eng.rooted:
                     raise RuntimeError(
-                        f"Stuck at root v={v} with nextPort=None but A_unsettled still nonempty: {sorted(A_unsettled)}"
+                        f"Stuck at root v={v} with nextPort=None but A_unsettled still nonempty: {list(A_unsettled)}"
                     )
+                if A_unsettled:
+                    # other DFSs hem this tree in: find an empty node and root a new tree there
+                    psi_v.sibling = siblingDetails
+                    siblingDetails = childDetails = None
+                    round_number = yield from _relocate(eng, v, round_number, max_rounds)
+                    amin = agents[A_scout.min()]
+                    amin.prevID = amin.childPort = None
+                    continue
             childDetails = (psi_v.ID, psi_v.portAtParent)
             if psi_v.recentChild is None:
                 psi_v.sibling = siblingDetails
             siblingDetails = None
             amin.childPort = None
             psi_v.recentPort = psi_v.parentPort
-            _move_group(G, agents, A_scout, v, psi_v.parentPort, round_number)
-            _snapshot(f"rooted_async:backtrack(v={v},p={psi_v.parentPort})", G, agents, round_number)
+            eng.phase = "backtrack"
+            _move_group(eng, A_scout, v, psi_v.parentPort, round_number)
+            eng.rec.snapshot(f"rooted_async:backtrack(v={v},p={psi_v.parentPort})", round_number)
             round_number+=1
+            metrics.rounds["backtrack"] += 1
 
-    round_number = retrace(G, agents, A_vacated, round_number, max_rounds)
-    _snapshot("rooted_async:exit", G, agents, round_number)
-    round_number+=1
+    if eng.rooted:
+        round_number = retrace(eng, round_number, max_rounds, root_node)
+    eng.rec.snapshot("rooted_async:exit", round_number)
+    return round_number
 
 
-def run_simulation(G, agents, max_rounds=-1):
+def _relocate(eng, v, round_number, max_rounds):
+    # general mode: walk the scouts depth-first from v over settled nodes,
+    # recognising them by their settled agent, until they step onto an empty
+    # node; yields after every hop but the last, returns the round number
+    G = eng.G
+    eng.phase = "relocate"
+    eng.relocating = True
+    seen = {_xi_id(eng, v)}
+    stack = [[v, 0, None]]  # node, next port to try, port back to its parent
+    try:
+        while stack:
+            if round_number > max_rounds:
+                raise RuntimeError("Round limit exceeded in relocate")
+            top = stack[-1]
+            u = top[0]
+            if top[1] == G.degree(u):
+                stack.pop()
+                if not stack:
+                    raise RuntimeError(f"No empty node left for the {len(eng.unsettled)} unsettled agents at {v}")
+                _move_group(eng, eng.scouts, u, top[2], round_number)
+                round_number+=1
+                eng.metrics.rounds["relocate"] += 1
+                yield round_number
+                continue
+            port = top[1]
+            top[1] += 1
+            if port == top[2]:
+                continue
+            w = _move_group(eng, eng.scouts, u, port, round_number)
+            round_number+=1
+            eng.metrics.rounds["relocate"] += 1
+            psi_w_id = _xi_id(eng, w)
+            if psi_w_id is None:
+                eng.rec.snapshot(f"relocate:found(v={w})", round_number)
+                return round_number
+            if psi_w_id in seen:
+                _move_group(eng, eng.scouts, w, eng.group.arrivalPort, round_number)
+                round_number+=1
+                eng.metrics.rounds["relocate"] += 1
+            else:
+                seen.add(psi_w_id)
+                stack.append([w, 0, eng.group.arrivalPort])
+            yield round_number
+    finally:
+        eng.relocating = False
+    raise RuntimeError(f"No empty node left for the {len(eng.unsettled)} unsettled agents at {v}")
+
+
+def general_async(eng, max_rounds):
+    """Disperse agents starting on several nodes: one DFS per starting node.
+
+    The DFSs run side by side on their own sets, group and round count, and
+    share the settled-agent indexes, so each sees the others' settled nodes
+    as occupied and their trees together form the dispersion forest. A DFS
+    hemmed in by the others walks on to an empty node and roots a new tree
+    there; one that meets another DFS's scouts on the way is subsumed by it.
+    Settled agents do not vacate in this mode (a vacated node would look
+    empty to the other DFSs). Returns the round the last DFS finished in.
+    """
+    agents = eng.agents
+    starts = {}
+    for aid in sorted(agents):
+        starts.setdefault(agents[aid].node, []).append(aid)
+    live = {}   # DFS number -> (sub-engine, its _dfs generator)
+    heap = []   # (round, DFS number): the DFS furthest behind moves next
+    for i, (node, ids) in enumerate(starts.items()):
+        sub = eng.split(ids)
+        live[i] = (sub, _dfs(sub, node, max_rounds))
+        heap.append((0, i))
+    heapq.heapify(heap)
+    last = 0
+    try:
+        while heap:
+            _, i = heapq.heappop(heap)
+            sub, steps = live[i]
+            try:
+                r = next(steps)
+            except StopIteration as done:
+                last = max(last, done.value)
+                del live[i]
+                continue
+            if sub.relocating:
+                node = sub.position()
+                j = next((j for j in live if j != i and live[j][0].position() == node), None)
+                if j is not None:
+                    into = live[j][0]
+                    if eng.events.active:
+                        eng.events.emit("merge", node=node, agents=len(sub.unsettled), into=len(into.unsettled))
+                    into.absorb(sub)
+                    steps.close()
+                    del live[i]
+                    continue
+            heapq.heappush(heap, (r, i))
+    finally:
+        for sub, _ in live.values():
+            sub.dissolve()
+    return last
+
+
+def _min_among(ids, among):
+    if not ids:
+        return None
+    return min((aid for aid in ids if aid in among), default=None)
+
+
+class IDSet:
+    """Set of agent IDs kept in ascending order.
+
+    Membership is a hash lookup; min/max and indexing read a sorted list that
+    add/discard keep in order, so the engines take agents in ID order
+    without re-sorting the set every step. Finding the slot is O(log k) but
+    insort/del shift the list, so an update is O(k): one memmove, cheap at
+    these sizes. A heap would make updates O(log k) but cannot index the
+    first scouts in order, as parallel_probe does.
+    """
+    __slots__ = ("_ids", "_set")
+
+    def __init__(self, ids=()):
+        self._set = set(ids)
+        self._ids = sorted(self._set)
+
+    def add(self, aid):
+        if aid not in self._set:
+            self._set.add(aid)
+            insort(self._ids, aid)
+
+    def discard(self, aid):
+        if aid in self._set:
+            self._set.remove(aid)
+            del self._ids[bisect_left(self._ids, aid)]
+
+    def remove(self, aid):
+        if aid not in self._set:
+            raise KeyError(aid)
+        self.discard(aid)
+
+    def min(self):
+        if not self._ids:
+            raise ValueError("min() of an empty IDSet")
+        return self._ids[0]
+
+    def max(self):
+        if not self._ids:
+            raise ValueError("max() of an empty IDSet")
+        return self._ids[-1]
+
+    def __contains__(self, aid):
+        return aid in self._set
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __iter__(self):
+        return iter(self._ids)
+
+    def __getitem__(self, i):
+        return self._ids[i]
+
+    def __repr__(self):
+        return "{" + ", ".join(map(str, self._ids)) + "}"
+
+
+class Engine:
+    """Per-run state: agents (in an AgentStore), their dispersion sets and
+    indexes, recorder.
+
+    unsettled, vacated and scouts (their union) are IDSets owned by
+    rooted_async and retrace; change them through mark_settled,
+    mark_vacated and unmark_vacated so scouts stays in sync.
+
+    The port graph is only read, so several engines may share one G (and
+    run concurrently in threads).
+    """
+
+    def __init__(self, G, agents, trace=TRACE_MOVE, events=None, metrics=None):
+        self.G = graph_utils.to_port_graph(G).build_port_tables()
+        self.events = simulation.events if events is None else events
+        self.metrics = Metrics(PHASES) if metrics is None else metrics
+        self.phase = "settle"  # the PHASES entry moves are booked to
+        if isinstance(agents, list):
+            agents = {a.ID: a for a in agents}
+        self.agents = agents
+        self.store = AgentStore.of(agents[k] for k in sorted(agents))  # rows in ID order
+        self.settled_at = {}   # node -> IDs of the agents _xi_id counts as settled there
+        self._settled_key = {}  # agent ID -> its node in settled_at
+        self.p1_back = {}      # (P1Neighbor, portAtP1Neighbor) -> IDs of the agents holding it
+        self.children = {}     # (parentID, portAtParent) -> IDs of the agents holding it
+        self._parent_key = {}  # agent ID -> its key in children
+        self._disperse(agents)
+        self.rooted = True  # False in general_async's DFSs
+        self.checkpoint_path = None  # see checkpoint()
+        self.resume_at = None        # where a checkpointed run goes on from
+        for a in agents.values():
+            a.moves = 0
+            self.reindex(a)
+            self._reparent(a)
+            if a.P1Neighbor is not None:
+                self.p1_back.setdefault((a.P1Neighbor, a.portAtP1Neighbor), set()).add(a.ID)
+        self.trace = check_trace_level(trace)
+        self.rec = Recorder()
+        self.rec.level = self.trace
+        self.rec.start(agents)
+
+    def _disperse(self, ids):
+        # the agents this engine's DFS moves, all on one node
+        self.own = set(ids)
+        self.unsettled = IDSet(ids)
+        self.vacated = IDSet()
+        self.scouts = IDSet(ids)
+        self.group = Group()    # the scouts that are moving together
+        self.strays = set(ids)  # scouts not in the group; gather() re-attaches them
+        self.phase = "settle"
+        self.relocating = False
+
+    def split(self, ids):
+        """A DFS over agents `ids` only, sharing everything else with self."""
+        sub = copy.copy(self)
+        sub._disperse(ids)
+        sub.rooted = False
+        return sub
+
+    def position(self):
+        """Node of the scouts (the lowest-ID one, should they be split up)."""
+        return self.agents[self.scouts.min()].node
+
+    def absorb(self, other):
+        """Take over the unsettled agents of `other`, a DFS whose scouts
+        stand on our scouts' node; they carry our DFS memory from now on."""
+        lead = self.agents[self.scouts.min()]
+        other.dissolve()
+        for aid in other.unsettled:
+            a = self.agents[aid]
+            a.prevID, a.childPort = lead.prevID, lead.childPort
+            self.own.add(aid)
+            self.unsettled.add(aid)
+            self.scouts.add(aid)
+            self.strays.add(aid)
+        other._disperse(())
+
+    def dissolve(self):
+        # hand every agent its own node, arrivalPort and moves back
+        for aid in list(self.group.members):
+            self._leave(aid)
+
+    def reindex(self, a):
+        """Update the settled-agent index after a moved, joined or left the
+        group, or changed state or home."""
+        # settled agents count wherever they are, settledScouts only at home
+        state = a.state
+        if a.group is None:
+            index = self.settled_at
+            if state == "settled" or (state == "settledScout" and a.home == a.node):
+                key = a.node
+            else:
+                key = None
+        else:
+            # group members are looked up by home, so group moves need no reindex
+            index = a.group.settled_by_home
+            key = _ANYWHERE if state == "settled" else a.home if state == "settledScout" else None
+        old_index, old_key = self._settled_key.get(a.ID, (None, None))
+        if old_index is index and old_key == key:
+            return
+        if old_key is not None:
+            old_index[old_key].discard(a.ID)
+            del self._settled_key[a.ID]
+        if key is not None:
+            index.setdefault(key, set()).add(a.ID)
+            self._settled_key[a.ID] = (index, key)
+
+    def gather(self, node):
+        """Re-attach the stray scouts at node to the group and return it."""
+        g = self.group
+        if g.members and g.node != node:
+            aid = min(g.members)
+            raise RuntimeError(f"Agent {aid} not at {node}, at {g.node}")
+        for aid in sorted(self.strays):
+            a = self.agents[aid]
+            if a.node != node:
+                raise RuntimeError(f"Agent {aid} not at {node}, at {a.node}")
+            g.attach(a)
+            self.reindex(a)
+        self.strays.clear()
+        return g
+
+    def stray(self, a):
+        """Detach scout a from the group so it can move on its own."""
+        self.group.detach(a)
+        self.strays.add(a.ID)
+        self.reindex(a)
+
+    def _leave(self, aid):
+        # aid stopped being a scout
+        a = self.agents[aid]
+        if a.group is not None:
+            a.group.detach(a)
+            self.reindex(a)
+        self.strays.discard(aid)
+
+    def _reparent(self, a):
+        key = (a.parentID, a.portAtParent) if a.parentID is not None else None
+        old = self._parent_key.get(a.ID)
+        if key == old:
+            return
+        if old is not None:
+            self.children[old].discard(a.ID)
+            del self._parent_key[a.ID]
+        if key is not None:
+            self.children.setdefault(key, set()).add(a.ID)
+            self._parent_key[a.ID] = key
+
+    def mark_settled(self, aid):
+        self.unsettled.discard(aid)
+        if aid not in self.vacated:
+            self.scouts.discard(aid)
+            self._leave(aid)
+
+    def mark_vacated(self, aid):
+        self.vacated.add(aid)
+        if aid not in self.scouts:
+            self.scouts.add(aid)
+            self.strays.add(aid)
+
+    def unmark_vacated(self, aid):
+        self.vacated.discard(aid)
+        if aid not in self.unsettled:
+            self.scouts.discard(aid)
+            self._leave(aid)
+
+    def set_p1_neighbor(self, a, neighbor_id, port):
+        """Set a.P1Neighbor / a.portAtP1Neighbor, keeping p1_back in sync."""
+        old = (a.P1Neighbor, a.portAtP1Neighbor)
+        if old[0] is not None:
+            self.p1_back[old].discard(a.ID)
+        a.P1Neighbor, a.portAtP1Neighbor = neighbor_id, port
+        self.p1_back.setdefault((neighbor_id, port), set()).add(a.ID)
+
+    def p1_back_id(self, neighbor_id, port, among):
+        """Smallest ID in `among` whose P1 neighbor is neighbor_id via port, else None."""
+        return _min_among(self.p1_back.get((neighbor_id, port)), among)
+
+    def child_id(self, parent_id, port, among):
+        """Smallest ID in `among` whose tree parent is parent_id via port, else None."""
+        return _min_among(self.children.get((parent_id, port)), among)
+
+    def changed(self, a):
+        """Propagate a change to a's state, home or parent pointers."""
+        self.rec.tree.update(self.G, a)
+        self.reindex(a)
+        self._reparent(a)
+
+    def checkpoint(self, path, every=1000):
+        """Save this run to `path` every `every` rounds, and when it exceeds
+        its round limit; load_checkpoint / resume_simulation continue it.
+
+        Only rooted runs (every agent starting on one node) checkpoint; the
+        file is replaced atomically, so it always holds a complete state.
+        """
+        self.checkpoint_path = path
+        self.checkpoint_every = every
+        self.next_checkpoint = every
+
+    def maybe_checkpoint(self, root_node, at, max_rounds):
+        # called at the top of the _dfs and retrace loops, at = (phase,
+        # round, loop state); saves when due and always on exceeding the
+        # round limit, so the run can go on from there
+        if self.checkpoint_path is None or not self.rooted:
+            return
+        if at[1] >= self.next_checkpoint or at[1] > max_rounds:
+            self.save_checkpoint((root_node,) + at, max_rounds)
+
+    def save_checkpoint(self, at, max_rounds):
+        # at = (root node, phase, round, loop state), see maybe_checkpoint.
+        # Event subscribers stay with the process that made them; the graph
+        # goes in by value, as a memory-mapped one would otherwise pickle as
+        # the path of a file the checkpoint does not own (a cache entry).
+        state = dict(vars(self))
+        del state["events"]
+        state["resume_at"] = at
+        state["max_rounds"] = max_rounds
+        path = self.checkpoint_path
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            pickler = pickle.Pickler(f, protocol=pickle.HIGHEST_PROTOCOL)
+            pickler.dispatch_table = copyreg.dispatch_table.copy()
+            pickler.dispatch_table[graph_utils.PortGraph] = _port_graph_by_value
+            pickler.dump(state)
+        os.replace(tmp, path)
+        self.next_checkpoint = at[2] + self.checkpoint_every
+
+    def run(self, max_rounds):
+        general = self.resume_at is None and len({a.node for a in self.agents.values()}) > 1
+        if general:
+            if self.checkpoint_path is not None:
+                raise ValueError("checkpoints need a rooted run (all agents on one node)")
+            rounds_used = general_async(self, max_rounds)
+        else:
+            if self.resume_at is None:
+                root_node, at = self.agents[min(self.agents)].node, None
+            else:
+                root_node, *at = self.resume_at
+            try:
+                rounds_used = rooted_async(self, root_node, max_rounds, at)
+            finally:
+                self.dissolve()
+        rec = self.rec
+        moves = self.store.values("_moves")
+        self.metrics.agent_moves = moves
+        if self.trace == TRACE_NONE:
+            return RunResult(rounds_used, self.store.values("home"),
+                             rec.tree.edges(), moves, self.metrics)
+        if self.trace == TRACE_FINAL:
+            rec.open_round("rooted_async:exit")
+        elif general:
+            # the DFSs share rec but count rounds on their own, so their exit
+            # snapshots may only relabel a round another DFS opened
+            rec.open_round("general_async:exit")
+        return (rec.all_positions, rec.all_statuses, rec.all_node_states, rec.all_homes, rec.all_tree_edges)
+
+
+def run_simulation(G, agents, max_rounds=-1, trace=TRACE_MOVE, events=None, metrics=None,
+                   checkpoint=None, checkpoint_every=1000):
+    """Disperse `agents` over G: rooted_async when they all start on one
+    node, general_async (one DFS per starting node) otherwise.
+
+    `trace` is one of simulation.TRACE_LEVELS. Every level but "none" returns
+    the (positions, statuses, node_states, homes, tree_edges) frame views;
+    "none" skips the trace entirely and returns a simulation.RunResult.
+    Engine events go to `events` (default: simulation.events); round and
+    move counts by phase go to `metrics`, a simulation.Metrics (a fresh one,
+    also found as RunResult.metrics, by default). With `checkpoint` (a
+    path), a rooted run saves itself there every `checkpoint_every` rounds
+    and on hitting the round limit; see resume_simulation.
+    """
     if len(agents)>len(G):
         raise RuntimeError("Agents should not be more than nodes")
     max_rounds = 200*len(agents)
-    simmer.clearr()
-    for u in G.nodes():
-        G.nodes[u]["agents"] = set()
-    if isinstance(agents, list):
-        agents = {a.ID: a for a in agents}
-    for aid, a in agents.items():
-        G.nodes[a.node]["agents"].add(aid)
-
-    root_node = agents[sorted(agents.keys())[0]].node #For rooted only
-    rooted_async(G, agents, root_node, max_rounds)
-    # try:
-    #     rooted_async(G, agents, root_node, max_rounds)
-    # except:
-    #     pass
-
-    return (simmer.all_positions, simmer.all_statuses, simmer.all_node_states, simmer.all_homes, simmer.all_tree_edges)
\ No newline at end of file
+    eng = Engine(G, agents, trace, events, metrics)
+    if checkpoint is not None:
+        eng.checkpoint(checkpoint, checkpoint_every)
+    return eng.run(max_rounds)
+
+
+def _port_graph_by_value(G):
+    # pickle reduction of a PortGraph that copies its arrays even when it is
+    # memory-mapped (np.asarray drops the memmap subclass)
+    return graph_utils.PortGraph, (np.asarray(G.offsets), np.asarray(G.neighbors), np.asarray(G.rev_ports))
+
+
+def load_checkpoint(path, events=None):
+    """The Engine saved at `path`, ready to run() on from its checkpoint.
+
+    Every call gives an independent copy, so one checkpoint can fork any
+    number of what-if continuations (change the copy, then run it). The
+    copy does not checkpoint itself until told to (Engine.checkpoint), and
+    its events go to `events` (default: simulation.events). Its round limit
+    when saved is in `max_rounds`.
+    """
+    with open(path, "rb") as f:
+        state = pickle.load(f)
+    eng = Engine.__new__(Engine)
+    eng.__dict__.update(state)
+    eng.G.build_port_tables()  # derived tables are not pickled
+    eng.events = simulation.events if events is None else events
+    eng.checkpoint_path = None
+    return eng
+
+
+def resume_simulation(path, max_rounds=None, events=None, checkpoint_every=1000):
+    """Continue the run checkpointed at `path`, saving on into the same
+    file; returns what run_simulation would have. `max_rounds` raises the
+    round limit (default: the one it was saved with)."""
+    eng = load_checkpoint(path, events)
+    eng.checkpoint(path, checkpoint_every)
+    eng.next_checkpoint = eng.resume_at[2] + checkpoint_every
+    return eng.run(eng.max_rounds if max_rounds is None else max_rounds)
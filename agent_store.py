@@ -0,0 +1,264 @@
+# agent_store.py
+"""Struct-of-arrays storage for agents.
+
+An AgentStore keeps one typed column per agent field, indexed by the
+agent's row, so a large run holds a few dozen NumPy arrays instead of one
+attribute dict per agent, and bulk reads (every agent's node, state, ...)
+are array operations. Agent classes derive from AgentView and declare their
+fields as Field descriptors; the instances are thin __slots__ views onto
+their row. A freshly constructed agent has no row yet and keeps its values
+in a small private dict until a store adopts it.
+"""
+import numpy as np
+
+NONE = -1  # int columns store None as -1
+
+
+class Field:
+    """One agent attribute, stored in column `column` (default: its name).
+
+    Values are kept as they are, in a plain list; subclasses use typed
+    NumPy columns.
+    """
+    def __init__(self, default=None, column=None, factory=None):
+        self.default = default
+        self.factory = factory  # called for a fresh default (dicts, lists)
+        self.column = column
+
+    def __set_name__(self, owner, name):
+        self.name = name
+        if self.column is None:
+            self.column = name
+
+    def initial(self):
+        return self.factory() if self.factory is not None else self.default
+
+    def __get__(self, a, owner=None):
+        if a is None:
+            return self
+        store = a._store
+        if store is None:
+            return a._vals[self.name]
+        return store.views[self.column][a._row]
+
+    def __set__(self, a, value):
+        store = a._store
+        if store is None:
+            a._vals[self.name] = value
+        else:
+            store.views[self.column][a._row] = value
+
+    def encode(self, value, store):
+        return value
+
+    def new_column(self, values, store):
+        return list(values)
+
+    def decode_column(self, col, store):
+        return list(col)
+
+
+class IntField(Field):
+    """Integer column; None is stored as -1."""
+    def __init__(self, default=None, column=None, dtype=np.int32):
+        super().__init__(default, column)
+        self.dtype = dtype
+
+    def __get__(self, a, owner=None):
+        if a is None:
+            return self
+        store = a._store
+        if store is None:
+            return a._vals[self.name]
+        v = store.views[self.column][a._row]
+        return None if v == NONE else v
+
+    def __set__(self, a, value):
+        store = a._store
+        if store is None:
+            a._vals[self.name] = value
+        else:
+            store.views[self.column][a._row] = NONE if value is None else value
+
+    def encode(self, value, store):
+        return NONE if value is None else value
+
+    def new_column(self, values, store):
+        return np.array([NONE if v is None else v for v in values], dtype=self.dtype)
+
+    def decode_column(self, col, store):
+        return [None if v == NONE else v for v in col.tolist()]
+
+
+class BoolField(Field):
+    def __init__(self, default=False, column=None):
+        super().__init__(default, column)
+
+    def new_column(self, values, store):
+        return np.array(values, dtype=np.bool_)
+
+    def decode_column(self, col, store):
+        return col.tolist()
+
+
+class EnumField(Field):
+    """One of a fixed tuple of values, stored as its int8 index."""
+    def __init__(self, values, default=None, column=None):
+        super().__init__(default, column)
+        self.values = tuple(values)
+        self.codes = {v: i for i, v in enumerate(self.values)}
+
+    def __get__(self, a, owner=None):
+        if a is None:
+            return self
+        store = a._store
+        if store is None:
+            return a._vals[self.name]
+        return self.values[store.views[self.column][a._row]]
+
+    def __set__(self, a, value):
+        store = a._store
+        if store is None:
+            a._vals[self.name] = value
+        else:
+            store.views[self.column][a._row] = self.codes[value]
+
+    def encode(self, value, store):
+        return self.codes[value]
+
+    def new_column(self, values, store):
+        return np.array([self.codes[v] for v in values], dtype=np.int8)
+
+    def decode_column(self, col, store):
+        return [self.values[c] for c in col.tolist()]
+
+
+class AgentRefField(Field):
+    """Reference to another agent of the same store, stored as its row."""
+    def __get__(self, a, owner=None):
+        if a is None:
+            return self
+        store = a._store
+        if store is None:
+            return a._vals[self.name]
+        row = store.views[self.column][a._row]
+        return None if row == NONE else store.agents[row]
+
+    def __set__(self, a, value):
+        store = a._store
+        if store is None:
+            a._vals[self.name] = value
+        else:
+            store.views[self.column][a._row] = NONE if value is None else store.row_of(value)
+
+    def encode(self, value, store):
+        return NONE if value is None else store.row_of(value)
+
+    def new_column(self, values, store):
+        return np.array([self.encode(v, store) for v in values], dtype=np.int32)
+
+    def decode_column(self, col, store):
+        return [None if r == NONE else store.agents[r] for r in col.tolist()]
+
+
+class AgentView:
+    """Base class of agents whose fields live in an AgentStore."""
+    __slots__ = ("_store", "_row", "_vals")
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        fields = {}
+        for klass in reversed(cls.__mro__):
+            for value in vars(klass).values():
+                if isinstance(value, Field):
+                    fields[value.name] = value
+        cls.fields = fields
+
+    def __init__(self):
+        self._store = None
+        self._row = None
+        self._vals = {name: f.initial() for name, f in self.fields.items()}
+
+    def _materialize(self):
+        # field values of an agent, wherever they are kept
+        if self._store is None:
+            return self._vals
+        return {name: getattr(self, name) for name in self.fields}
+
+
+class AgentStore:
+    """Columns holding every field of a list of agents of one class.
+
+    `columns[name]` is the NumPy array (or list, for untyped fields) of a
+    field, indexed by row; rows follow the order of `agents`. `views` holds
+    memoryviews of the same arrays, which the Field descriptors use because
+    they index faster than NumPy and return plain Python values.
+    """
+    def __init__(self, agents):
+        agents = list(agents)
+        if not agents:
+            raise ValueError("an AgentStore needs at least one agent")
+        cls = type(agents[0])
+        for a in agents:
+            if type(a) is not cls:
+                raise TypeError("all agents of a store must have the same class")
+        self.cls = cls
+        self.agents = agents
+        vals = [a._materialize() for a in agents]
+        for row, a in enumerate(agents):
+            a._store, a._row, a._vals = self, row, None
+        self.columns = {}
+        for name, f in cls.fields.items():
+            self.columns[f.column] = f.new_column([v[name] for v in vals], self)
+        self._bind()
+
+    def _bind(self):
+        self.views = {name: col if isinstance(col, list) else memoryview(col)
+                      for name, col in self.columns.items()}
+
+    def __getstate__(self):
+        return {"cls": self.cls, "agents": self.agents, "columns": self.columns}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._bind()
+
+    @classmethod
+    def of(cls, agents):
+        """The store holding exactly `agents` (in that order), creating it if needed."""
+        agents = list(agents)
+        store = agents[0]._store if agents else None
+        if store is not None and store.agents == agents:
+            return store
+        return cls(agents)
+
+    def __len__(self):
+        return len(self.agents)
+
+    def row_of(self, a):
+        if a._store is not self:
+            raise ValueError("agent belongs to another store")
+        return a._row
+
+    def values(self, name, rows=None):
+        """Decoded values of field `name` for `rows` (all rows by default)."""
+        f = self.cls.fields[name]
+        col = self.columns[f.column]
+        if rows is not None:
+            col = col[rows] if not isinstance(col, list) else [col[r] for r in rows]
+        return f.decode_column(col, self)
+
+
+    def rows_of(self, agents):
+        """Row numbers of `agents` (which must belong to this store), as an array."""
+        return np.fromiter((a._row for a in agents), dtype=np.intp, count=len(agents))
+
+    def fill(self, name, rows, value):
+        """Set field `name` of the agents in `rows` to the same value."""
+        f = self.cls.fields[name]
+        col = self.columns[f.column]
+        if isinstance(col, list):
+            for r in np.asarray(rows).tolist():
+                col[r] = value
+        else:
+            col[rows] = f.encode(value, self)
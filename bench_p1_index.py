@@ -0,0 +1,56 @@
+# bench_p1_index.py
+# Compares parallel_probe's (P1Neighbor, portAtP1Neighbor) lookup by linear
+# scan over the scouts against the Engine.p1_back index.
+#
+#   python bench_p1_index.py [k] [queries]
+import random
+import sys
+import time
+
+import graph_utils
+import agent_help_scouts
+
+
+def scan(agents, A_scout, neighbor_id, port):
+    # the lookup parallel_probe used before Engine.p1_back
+    return next((bid for bid in A_scout if agents[bid].P1Neighbor == neighbor_id and agents[bid].portAtP1Neighbor == port), None)
+
+
+def main():
+    k = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    num_queries = int(sys.argv[2]) if len(sys.argv) > 2 else 2_000
+    degree = 4
+    rng = random.Random(0)
+
+    G = graph_utils.create_port_graph(k, degree, 0)
+    agents = {i: agent_help_scouts.Agent(i, 0) for i in range(k)}
+    eng = agent_help_scouts.Engine(G, agents, trace="none")
+
+    # half the agents have vacated and point back at a neighbour's agent
+    for aid in rng.sample(range(k), k // 2):
+        eng.set_p1_neighbor(agents[aid], rng.randrange(k), rng.randrange(degree))
+    A_scout = sorted(agents)
+    scout_ids = frozenset(A_scout)
+
+    held = list(eng.p1_back)
+    queries = [rng.choice(held) if i % 2 else (rng.randrange(k), rng.randrange(degree))
+               for i in range(num_queries)]
+
+    t = time.perf_counter()
+    expected = [scan(agents, A_scout, nb, port) for nb, port in queries]
+    t_scan = time.perf_counter() - t
+
+    t = time.perf_counter()
+    got = [eng.p1_back_id(nb, port, scout_ids) for nb, port in queries]
+    t_index = time.perf_counter() - t
+
+    if got != expected:
+        raise RuntimeError("index and scan disagree")
+    print(f"k={k}, queries={num_queries}")
+    print(f"scan : {t_scan:8.4f}s  ({1e6 * t_scan / num_queries:9.2f} us/lookup)")
+    print(f"index: {t_index:8.4f}s  ({1e6 * t_index / num_queries:9.2f} us/lookup)")
+    print(f"speedup: {t_scan / t_index:.0f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+# check_randomize.py
+# Randomizes the ports of memory-mapped PortGraphs (load_port_graph and
+# graph_cache.get hand out read-only ones) and checks each gets the ports an
+# in-memory copy gets from the same seed, while its file stays untouched.
+#
+#   python check_randomize.py [nodes] [seeds]
+import os
+import pickle
+import sys
+import tempfile
+
+import numpy as np
+
+import graph_utils
+
+
+def arrays(G):
+    return G.offsets.tolist(), G.neighbors.tolist(), G.rev_ports.tolist()
+
+
+def check(G, seed):
+    path = G.path
+    stored = arrays(G)
+    expected = graph_utils.randomize_ports(graph_utils.load_port_graph(path, mmap=False), seed)
+    graph_utils.randomize_ports(G, seed)
+    if arrays(G) != arrays(expected):
+        raise RuntimeError(f"{path}: randomized differently from an in-memory copy")
+    if arrays(graph_utils.load_port_graph(path)) != stored:
+        raise RuntimeError(f"{path}: file changed by randomizing")
+    if G.path is not None or arrays(pickle.loads(pickle.dumps(G))) != arrays(G):
+        raise RuntimeError(f"{path}: randomized graph still pickles as its file")
+    if not np.array_equal(G.build_port_tables().p1_neighbors, expected.build_port_tables().p1_neighbors):
+        raise RuntimeError(f"{path}: stale port tables after randomizing")
+
+
+def main():
+    nodes = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    seeds = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    with tempfile.TemporaryDirectory() as d:
+        cache = graph_utils.GraphCache(os.path.join(d, "cache"))
+        for seed in range(seeds):
+            path = os.path.join(d, f"{seed}.pg")
+            graph_utils.save_port_graph(graph_utils.create_port_graph(nodes, 4, seed), path)
+            check(graph_utils.load_port_graph(path), seed + 1)
+            check(cache.get(nodes, 4, seed), seed + 1)
+    print(f"{seeds} seeds x 2 memory-mapped graphs on {nodes} nodes: OK")
+
+
+if __name__ == "__main__":
+    main()
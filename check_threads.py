@@ -0,0 +1,53 @@
+# check_threads.py
+# Runs help-by-scouts in several threads on one shared, freshly built
+# PortGraph and checks every thread gets the serial result. Guards the lazy
+# build_port_tables against threads reading half-built tables.
+#
+#   python check_threads.py [threads] [nodes] [agents] [trials]
+import sys
+import threading
+
+import graph_utils
+import agent_help_scouts
+
+
+def run(G, k):
+    agents = [agent_help_scouts.Agent(i, 0) for i in range(k)]
+    r = agent_help_scouts.run_simulation(G, agents, trace="none")
+    return r.rounds, r.homes, r.moves
+
+
+def main():
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else 6
+    nodes = int(sys.argv[2]) if len(sys.argv) > 2 else 200_000
+    k = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+    trials = int(sys.argv[4]) if len(sys.argv) > 4 else 20
+
+    expected = run(graph_utils.create_port_graph(nodes, 4, 0), k)
+    for trial in range(trials):
+        G = graph_utils.create_port_graph(nodes, 4, 0)  # port tables not built yet
+        start = threading.Barrier(threads)
+        results = [None] * threads
+
+        def work(i):
+            start.wait()
+            try:
+                results[i] = run(G, k)
+            except Exception as e:
+                results[i] = e
+
+        pool = [threading.Thread(target=work, args=(i,)) for i in range(threads)]
+        for t in pool:
+            t.start()
+        for t in pool:
+            t.join()
+        for i, r in enumerate(results):
+            if isinstance(r, Exception):
+                raise RuntimeError(f"trial {trial}, thread {i} failed") from r
+            if r != expected:
+                raise RuntimeError(f"trial {trial}, thread {i} disagrees with the serial run")
+    print(f"{trials} trials x {threads} threads on {nodes} nodes: OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -14,7 +14,8 @@ let filteredHomes = [];
 let filteredTreeEdges = [];
 let filteredLeaders = [];
 let filteredLevels = [];
-let filteredNodeStates = [];
+let filteredNodeStates = []; // frame numbers into nodeStateFrames, one per filtered step
+let nodeStateFrames = null;
 let originalNodes = [];
 let originalEdges = [];
 
@@ -36,6 +37,43 @@ function computeAgentColor(leaderId, level) {
   return `hsl(${hue}, 70%, ${lightness}%)`;
 }
 
+// node_settled_states frames are either full ("node_states_encoding":
+// "full", the default) or sparse diffs ("diff"): frame i then holds only the
+// nodes whose state changed since frame i-1. Full frames are rebuilt on
+// demand, replaying forward from the last one built.
+class NodeStateFrames {
+  constructor(frames, encoding, nodeIds) {
+    this.frames = frames || [];
+    this.sparse = encoding === "diff";
+    this.nodeIds = nodeIds;
+    this.builtIndex = -1;
+    this.built = null;
+  }
+
+  get length() {
+    return this.frames.length;
+  }
+
+  at(i) {
+    if (i < 0 || i >= this.frames.length) return undefined;
+    if (!this.sparse) return this.frames[i];
+    if (this.built === null || i < this.builtIndex) {
+      this.built = Object.fromEntries(this.nodeIds.map((id) => [id, null]));
+      this.builtIndex = -1;
+    }
+    for (let j = this.builtIndex + 1; j <= i; j++) {
+      Object.assign(this.built, this.frames[j][1]);
+    }
+    this.builtIndex = i;
+    return [this.frames[i][0], { ...this.built }];
+  }
+}
+
+function nodeStatesForStep(step) {
+  const i = filteredNodeStates[step];
+  return i === undefined || !nodeStateFrames ? undefined : nodeStateFrames.at(i);
+}
+
 function filterSimulationDataForSteps(originalData, flags) {
   const { showScout, showChase, showFollow } = flags;
   const positions = [];
@@ -56,7 +94,7 @@ function filterSimulationDataForSteps(originalData, flags) {
   if (originalData.tree_edges?.[0]) treeEdges.push(originalData.tree_edges[0]);
   if (originalData.leaders?.[0]) leaders.push(originalData.leaders[0]);
   if (originalData.levels?.[0]) levels.push(originalData.levels[0]);
-  if (originalData.node_settled_states?.[0]) nodeStates.push(originalData.node_settled_states[0]);
+  if (originalData.node_settled_states?.[0]) nodeStates.push(0);
 
   for (let i = 1; i < originalData.positions.length; i++) {
     const label = originalData.positions[i][0].toLowerCase();
@@ -73,7 +111,7 @@ function filterSimulationDataForSteps(originalData, flags) {
       if (originalData.tree_edges?.[i]) treeEdges.push(originalData.tree_edges[i]);
       if (originalData.leaders?.[i]) leaders.push(originalData.leaders[i]);
       if (originalData.levels?.[i]) levels.push(originalData.levels[i]);
-      if (originalData.node_settled_states?.[i]) nodeStates.push(originalData.node_settled_states[i]);
+      if (originalData.node_settled_states?.[i]) nodeStates.push(i);
     } else {
       if (DEBUG)
         console.log(
@@ -196,6 +234,11 @@ function updateTooltip(node, event) {
     const positionsAtStep = filteredPositions[stepIndex]?.[1] || [];
     const statusesAtStep  = filteredStatuses[stepIndex]?.[1] || [];
     const homesAtStep  = filteredHomes[stepIndex]?.[1] || [];
+    const nodeState = nodeStatesForStep(stepIndex)?.[1]?.[nodeId];
+
+    if (nodeState?.settled_agent_id != null) {
+      content += `<strong>Settled agent:</strong> A${nodeState.settled_agent_id}<br>`;
+    }
 
     // Collect ALL agents currently at this node
     const agentIdxsHere = [];
@@ -505,6 +548,7 @@ export function drawCytoscape(containerId, originalData) {
   filteredLeaders = [];
   filteredLevels = [];
   filteredNodeStates = [];
+  nodeStateFrames = null;
   originalNodes = originalData.nodes || [];
   originalEdges = originalData.edges || [];
   originalData.tree_edges = originalData.tree_edges || [];
@@ -537,6 +581,11 @@ export function drawCytoscape(containerId, originalData) {
     showFollow: document.getElementById("showFollowCheck")?.checked ?? true,
   };
   originalData.node_settled_states = originalData.node_settled_states || [];
+  nodeStateFrames = new NodeStateFrames(
+    originalData.node_settled_states,
+    originalData.node_states_encoding,
+    originalNodes.map((n) => n.data.id)
+  );
 
   const filteredData = filterSimulationDataForSteps(originalData, flags);
   filteredPositions = filteredData.positions;
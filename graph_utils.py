@@ -1,9 +1,19 @@
 # graph_utils.py
 
+import hashlib
+import os
+import sys
+
 import networkx as nx # type: ignore
+import numpy as np
 import random
 
 def create_port_labeled_graph(nodes, max_degree, seed):
+    """networkx G(n, m) sample, resampled until connected.
+
+    Kept so recorded (nodes, degree, seed) configurations stay reproducible;
+    new code should prefer `create_port_graph`.
+    """
     attempt = 0
     while True:
         # G = nx.random_regular_graph(max_degree, nodes, seed=seed + attempt)
@@ -20,7 +30,14 @@ def create_port_labeled_graph(nodes, max_degree, seed):
     return G
 
 def randomize_ports(G, seed):
-    """Shuffle each node’s ports, updating both edge data and node.port_map."""
+    """Shuffle each node’s ports, updating both edge data and node.port_map.
+
+    PortGraphs are shuffled in place by `_randomize_port_graph`; networkx
+    graphs keep the original per-node loop (which reseeds `random`) so that
+    recorded seeds reproduce.
+    """
+    if isinstance(G, PortGraph):
+        return _randomize_port_graph(G, seed)
     random.seed(seed)
     for u in G.nodes():
         neighs = list(G.neighbors(u))
@@ -33,6 +50,90 @@ def randomize_ports(G, seed):
             port_map[p] = v
         G.nodes[u]['port_map'] = port_map
 
+def create_port_graph(nodes, max_degree, seed):
+    """Random connected PortGraph whose degrees never exceed max_degree.
+
+    Built in one pass: a random spanning tree that only attaches to nodes with
+    spare capacity, then the remaining port capacity is paired up at random
+    (configuration-model style), dropping self-loops and repeated edges.
+    The same (nodes, max_degree, seed) always gives the same graph.
+    """
+    if nodes > 2 and max_degree < 2 or nodes == 2 and max_degree < 1:
+        raise ValueError(f"cannot connect {nodes} nodes with max_degree={max_degree}")
+    rng = np.random.default_rng(seed)
+    tree_u, tree_v = _bounded_spanning_tree(nodes, max_degree, rng)
+
+    deg = np.bincount(np.concatenate([tree_u, tree_v]), minlength=nodes)
+    stubs = np.repeat(np.arange(nodes, dtype=np.int64), max_degree - deg)
+    rng.shuffle(stubs)
+    stubs = stubs[:len(stubs) - len(stubs) % 2]
+    a, b = stubs[0::2], stubs[1::2]
+    a, b = np.minimum(a, b), np.maximum(a, b)
+    keep = a != b
+    a, b = a[keep], b[keep]
+    keys = a * nodes + b
+    _, first = np.unique(keys, return_index=True)
+    first.sort()
+    tree_keys = np.minimum(tree_u, tree_v) * nodes + np.maximum(tree_u, tree_v)
+    first = first[~np.isin(keys[first], tree_keys)]
+
+    us = np.concatenate([tree_u, a[first]])
+    vs = np.concatenate([tree_v, b[first]])
+    return port_graph_from_edges(nodes, us, vs)
+
+
+def _bounded_spanning_tree(n, cap, rng):
+    """Random tree on 0..n-1 with every degree <= cap, as two endpoint arrays."""
+    order = rng.permutation(n).tolist()
+    picks = rng.random(n).tolist()
+    parents = [0] * max(n - 1, 0)
+    deg = [0] * n
+    open_nodes = order[:1]  # nodes that can still take a child
+    for i in range(1, n):
+        j = int(picks[i] * len(open_nodes))
+        u = open_nodes[j]
+        parents[i - 1] = u
+        deg[u] += 1
+        if deg[u] == cap:
+            open_nodes[j] = open_nodes[-1]
+            open_nodes.pop()
+        v = order[i]
+        deg[v] = 1
+        if cap > 1:
+            open_nodes.append(v)
+    return np.array(parents, dtype=np.int64), np.array(order[1:], dtype=np.int64)
+
+def _randomize_port_graph(G, seed):
+    """Uniformly permute the ports of every node of a PortGraph, in place.
+
+    Nodes are batched by degree and each batch is shuffled row-wise with a
+    private numpy Generator, so the global `random` state is left alone.
+    The reverse-port table is remapped in the same pass. The permuted
+    arrays are new, private buffers, so memory-mapped (read-only) graphs
+    can be randomized too; G then no longer matches its file and stops
+    being backed by it.
+    """
+    rng = np.random.default_rng(seed)
+    offsets = G.offsets
+    deg = np.diff(offsets)
+    # perm[new_slot] = old_slot
+    perm = np.arange(len(G.neighbors), dtype=np.int64)
+    for d in np.unique(deg):
+        if d < 2:
+            continue
+        slots = offsets[:-1][deg == d, None] + np.arange(d)
+        perm[slots] = rng.permuted(slots, axis=1)
+    new_slot = np.empty_like(perm)
+    new_slot[perm] = np.arange(len(perm))
+
+    neighbors = np.asarray(G.neighbors[perm])
+    far_old = offsets[neighbors] + G.rev_ports[perm]
+    G.neighbors = neighbors
+    G.rev_ports = (new_slot[far_old] - offsets[neighbors]).astype(np.int32)
+    G.path = None
+    G._bind()
+    return G
+
 def assign_weights(G, min_weight=0.0, max_weight=10.0):
     """Assign a random Gaussian weight to each edge."""
     mid = (min_weight + max_weight) / 2
@@ -42,3 +143,408 @@ def assign_weights(G, min_weight=0.0, max_weight=10.0):
 
 def get_neighbor_by_port(G, u, port):
     return G.nodes[u].get('port_map', {}).get(port)
+
+
+# edge classes by which end of the edge is port 1 (port 0 here), indexed by
+# (local port != 0) + 2 * (remote port != 0)
+EDGE_TYPES = ("t11", "tp1", "t1q", "tpq")
+
+
+class PortGraph:
+    """Port-labeled graph stored as CSR arrays.
+
+    The ports of node u live in slots offsets[u] .. offsets[u+1]-1, so port p
+    of u is slot offsets[u] + p. neighbors[slot] is the node behind that port
+    and rev_ports[slot] is the port at that neighbor leading back to u.
+    """
+    __slots__ = ("offsets", "neighbors", "rev_ports", "path",
+                 "edge_types", "p1_neighbors", "p1_ports",
+                 "_off", "_nbr", "_rev", "_etype", "_p1", "_p1back", "_tables")
+
+    def __init__(self, offsets, neighbors, rev_ports, path=None):
+        self.offsets = np.ascontiguousarray(offsets, dtype=np.int64)
+        self.neighbors = np.ascontiguousarray(neighbors, dtype=np.int32)
+        self.rev_ports = np.ascontiguousarray(rev_ports, dtype=np.int32)
+        self.path = path  # backing file when memory-mapped by load_port_graph
+        self._bind()
+
+    def _bind(self):
+        # memoryviews hand back plain ints, which is much faster than numpy
+        # scalar indexing on the per-hop paths of the engines
+        self._off = memoryview(self.offsets)
+        self._nbr = memoryview(self.neighbors)
+        self._rev = memoryview(self.rev_ports)
+        self.clear_port_tables()
+
+    def build_port_tables(self):
+        """Precompute per-slot edge types and each node's port-1 neighbor.
+
+        Both depend only on the port labeling, so the engines build them once
+        per run; randomize_ports clears them. Returns self.
+
+        Engines in several threads may share one graph: the tables are built
+        in locals and edge_types, the "built" flag, is published last, so a
+        thread that sees it set also sees the rest. Two threads may both
+        build them; either result is the same.
+        """
+        if self.edge_types is not None:
+            return self
+        n = len(self.offsets) - 1
+        deg = np.diff(self.offsets)
+        port = np.arange(len(self.neighbors)) - np.repeat(self.offsets[:-1], deg)
+        edge_types = ((port != 0) + 2 * (self.rev_ports != 0)).astype(np.int8)
+        p1_neighbors = np.full(n, -1, dtype=np.int32)
+        p1_ports = np.full(n, -1, dtype=np.int32)
+        has_p1 = deg > 0
+        p1_neighbors[has_p1] = self.neighbors[self.offsets[:-1][has_p1]]
+        p1_ports[has_p1] = self.rev_ports[self.offsets[:-1][has_p1]]
+        self.p1_neighbors, self.p1_ports = p1_neighbors, p1_ports
+        self._etype = memoryview(edge_types)
+        self._p1 = memoryview(p1_neighbors)
+        self._p1back = memoryview(p1_ports)
+        self.edge_types = edge_types
+        return self
+
+    def clear_port_tables(self):
+        self.edge_types = self.p1_neighbors = self.p1_ports = None
+        self._etype = self._p1 = self._p1back = None
+        self._tables = {}
+
+    def port_table(self, name, build):
+        """Table `name` derived from the port labeling: build(self), computed
+        on first use and kept until the ports change (clear_port_tables)."""
+        table = self._tables.get(name)
+        if table is None:
+            table = self._tables[name] = build(self)
+        return table
+
+    def __getstate__(self):
+        # memory-mapped graphs travel by path, so worker processes map the
+        # same read-only pages instead of receiving a copy of the arrays
+        if self.path is not None:
+            return {"path": self.path}
+        return {"offsets": self.offsets, "neighbors": self.neighbors, "rev_ports": self.rev_ports}
+
+    def __setstate__(self, state):
+        self.path = state.get("path")
+        if self.path is not None:
+            G = load_port_graph(self.path)
+            state = {"offsets": G.offsets, "neighbors": G.neighbors, "rev_ports": G.rev_ports}
+        self.offsets = state["offsets"]
+        self.neighbors = state["neighbors"]
+        self.rev_ports = state["rev_ports"]
+        self._bind()
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def number_of_nodes(self):
+        return len(self.offsets) - 1
+
+    def number_of_edges(self):
+        return len(self.neighbors) // 2
+
+    def nodes(self):
+        return range(len(self.offsets) - 1)
+
+    def degree(self, u):
+        return self._off[u + 1] - self._off[u]
+
+    def neighbor(self, u, port):
+        """Node behind `port` of u, or None if u has no such port."""
+        if port is None or port < 0 or port >= self._off[u + 1] - self._off[u]:
+            return None
+        return self._nbr[self._off[u] + port]
+
+    def reverse_port(self, u, port):
+        """Port at neighbor(u, port) that leads back to u."""
+        return self._rev[self._off[u] + port]
+
+    def edge_type(self, u, port):
+        """EDGE_TYPES name of the edge behind `port` of u (needs build_port_tables)."""
+        return EDGE_TYPES[self._etype[self._off[u] + port]]
+
+    def p1_neighbor(self, u):
+        """(node behind port 1 of u, port there leading back), or (None, None) if u is isolated."""
+        v = self._p1[u]
+        if v < 0:
+            return None, None
+        return v, self._p1back[u]
+
+    def port_to(self, u, v):
+        """Port of u leading to v (linear in deg(u)); None if not adjacent."""
+        start = self._off[u]
+        for p in range(self._off[u + 1] - start):
+            if self._nbr[start + p] == v:
+                return p
+        return None
+
+    def port_edges(self):
+        """Yield every edge once as (u, port_at_u, v, port_at_v) with u < v."""
+        off, nbr, rev = self._off, self._nbr, self._rev
+        for u in range(len(off) - 1):
+            start = off[u]
+            for p in range(off[u + 1] - start):
+                v = nbr[start + p]
+                if u < v:
+                    yield u, p, v, rev[start + p]
+
+    def to_networkx(self):
+        """Build the equivalent networkx graph with `port_map` / `port_{u}` attributes."""
+        G = nx.Graph()
+        G.add_nodes_from(self.nodes())
+        for u, pu, v, pv in self.port_edges():
+            G.add_edge(u, v, **{f'port_{u}': pu, f'port_{v}': pv})
+        for u in self.nodes():
+            start = self._off[u]
+            G.nodes[u]['port_map'] = {p: self._nbr[start + p] for p in range(self.degree(u))}
+        return G
+
+
+def _reverse_ports(offsets, neighbors):
+    """For every slot u->v, the port of v whose slot points back to u."""
+    n = len(offsets) - 1
+    src = np.repeat(np.arange(n, dtype=np.int64), np.diff(offsets))
+    dst = neighbors.astype(np.int64)
+    # the k-th slot in (src, dst) order and the k-th slot in (dst, src) order
+    # are the two directions of the same edge
+    partner = np.empty(len(dst), dtype=np.int64)
+    partner[np.argsort(src * n + dst)] = np.argsort(dst * n + src)
+    return (partner - offsets[dst]).astype(np.int32)
+
+
+def port_graph_from_edges(n, us, vs):
+    """PortGraph on nodes 0..n-1 from an undirected edge list (us[i], vs[i]).
+
+    Ports at each node are numbered in the order its edges appear in the list.
+    """
+    us = np.asarray(us, dtype=np.int64)
+    vs = np.asarray(vs, dtype=np.int64)
+    # edge i contributes slots 2i (at us[i]) and 2i+1 (at vs[i])
+    src = np.column_stack([us, vs]).ravel()
+    dst = np.column_stack([vs, us]).ravel()
+    order = np.argsort(src, kind='stable')
+    offsets = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(src, minlength=n), out=offsets[1:])
+    neighbors = dst[order].astype(np.int32)
+    return PortGraph(offsets, neighbors, _reverse_ports(offsets, neighbors))
+
+
+def sort_ports(G):
+    """Copy of PortGraph G whose ports at every node follow ascending neighbor id."""
+    n = G.number_of_nodes()
+    src = np.repeat(np.arange(n, dtype=np.int64), np.diff(G.offsets))
+    order = np.lexsort((G.neighbors, src))
+    neighbors = G.neighbors[order]
+    return PortGraph(G.offsets.copy(), neighbors, _reverse_ports(G.offsets, neighbors))
+
+
+def to_port_graph(G):
+    """Return G as a PortGraph, converting a networkx port-labeled graph if needed.
+
+    Ports are taken from the `port_map` node attributes written by
+    `create_port_labeled_graph` / `randomize_ports`; nodes must be 0..n-1.
+    """
+    if isinstance(G, PortGraph):
+        return G
+    n = G.number_of_nodes()
+    if set(G.nodes()) != set(range(n)):
+        raise ValueError("to_port_graph expects nodes labeled 0..n-1")
+    offsets = np.zeros(n + 1, dtype=np.int64)
+    for u in range(n):
+        offsets[u + 1] = offsets[u] + G.degree[u]
+    neighbors = np.empty(offsets[-1], dtype=np.int32)
+    for u in range(n):
+        port_map = G.nodes[u].get('port_map')
+        if port_map is None:
+            port_map = dict(enumerate(G.neighbors(u)))
+        start = offsets[u]
+        for p, v in port_map.items():
+            neighbors[start + p] = v
+    return PortGraph(offsets, neighbors, _reverse_ports(offsets, neighbors))
+
+
+# On-disk layout written by save_port_graph: a 32-byte header
+# (magic, version, n, number of slots) followed by offsets (int64),
+# neighbors (int32), padding to 8 bytes, rev_ports (int32); little-endian.
+_PG_MAGIC = b"CCMPORTG"
+_PG_VERSION = 1
+_PG_HEADER = 32
+
+
+def save_port_graph(G, path):
+    """Write a PortGraph in the raw binary layout read by `load_port_graph`."""
+    n = G.number_of_nodes()
+    slots = len(G.neighbors)
+    header = np.array([_PG_VERSION, n, slots], dtype='<i8')
+    with open(path, 'wb') as f:
+        f.write(_PG_MAGIC)
+        f.write(header.tobytes())
+        f.write(np.asarray(G.offsets, dtype='<i8').tobytes())
+        f.write(np.asarray(G.neighbors, dtype='<i4').tobytes())
+        f.write(b"\0" * (4 * (slots % 2)))
+        f.write(np.asarray(G.rev_ports, dtype='<i4').tobytes())
+
+
+def load_port_graph(path, mmap=True):
+    """Read a PortGraph saved by `save_port_graph`, memory-mapped read-only by default."""
+    with open(path, 'rb') as f:
+        head = f.read(_PG_HEADER)
+    if len(head) != _PG_HEADER or head[:8] != _PG_MAGIC:
+        raise ValueError(f"{path} is not a port graph file")
+    version, n, slots = np.frombuffer(head, dtype='<i8', offset=8)
+    if version != _PG_VERSION:
+        raise ValueError(f"{path}: unsupported port graph version {version}")
+    n, slots = int(n), int(slots)
+    nbr_at = _PG_HEADER + 8 * (n + 1)
+    rev_at = nbr_at + 4 * (slots + slots % 2)
+
+    def read(dtype, count, offset):
+        if count == 0:
+            return np.zeros(0, dtype=dtype)
+        if mmap:
+            return np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=(count,))
+        return np.fromfile(path, dtype=dtype, count=count, offset=offset)
+
+    return PortGraph(read('<i8', n + 1, _PG_HEADER), read('<i4', slots, nbr_at), read('<i4', slots, rev_at),
+                     path=os.path.abspath(path) if mmap else None)
+
+
+def load_edge_list(path, nodes=None):
+    """PortGraph from a whitespace-separated edge list, one edge per line.
+
+    Lines are `u v` or `u v port_at_u port_at_v`; `#` starts a comment.
+    Without port columns, ports follow the order edges appear in the file.
+    With them, the ports of every node must be exactly 0..deg-1. Nodes are
+    0..n-1 with n = nodes or the largest id + 1.
+    """
+    data = np.loadtxt(path, dtype=np.int64, comments='#', ndmin=2)
+    if data.shape[1] not in (2, 4):
+        raise ValueError(f"{path}: expected 2 or 4 columns, got {data.shape[1]}")
+    us, vs = data[:, 0], data[:, 1]
+    n = nodes if nodes is not None else (int(max(us.max(), vs.max())) + 1 if len(us) else 0)
+    if data.shape[1] == 2:
+        return port_graph_from_edges(n, us, vs)
+    return _port_graph_from_port_columns(n, us, vs, data[:, 2], data[:, 3])
+
+
+def _port_graph_from_port_columns(n, us, vs, pus, pvs):
+    src = np.concatenate([us, vs])
+    dst = np.concatenate([vs, us])
+    port = np.concatenate([pus, pvs])
+    back = np.concatenate([pvs, pus])
+    deg = np.bincount(src, minlength=n)
+    offsets = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(deg, out=offsets[1:])
+    if ((port < 0) | (port >= deg[src])).any():
+        raise ValueError("port number outside 0..deg-1")
+    slot = offsets[src] + port
+    neighbors = np.full(len(src), -1, dtype=np.int32)
+    neighbors[slot] = dst
+    if (neighbors < 0).any():
+        raise ValueError("a node uses the same port for two edges")
+    rev_ports = np.empty(len(src), dtype=np.int32)
+    rev_ports[slot] = back
+    return PortGraph(offsets, neighbors, rev_ports)
+
+
+def load_graph(path, mmap=True, nodes=None):
+    """Load a PortGraph from either the native binary format or an edge list."""
+    with open(path, 'rb') as f:
+        binary = f.read(len(_PG_MAGIC)) == _PG_MAGIC
+    if binary:
+        return load_port_graph(path, mmap=mmap)
+    return load_edge_list(path, nodes=nodes)
+
+
+def _build_port_graph(generator, nodes, max_degree, seed, port_seed):
+    if generator == "create_port_labeled_graph":
+        G = create_port_labeled_graph(nodes, max_degree, seed)
+        randomize_ports(G, port_seed)
+        return to_port_graph(G)
+    if generator == "create_port_graph":
+        return randomize_ports(create_port_graph(nodes, max_degree, seed), port_seed)
+    raise ValueError(f"unknown graph generator {generator!r}")
+
+
+class GraphCache:
+    """Disk cache of generated, port-randomized PortGraphs.
+
+    Entries are keyed by a hash of (generator, nodes, max_degree, seed,
+    port_seed) and stored with `save_port_graph`; every graph returned,
+    freshly built or not, is loaded back from its entry (memory-mapped).
+    When the directory grows past max_bytes the least recently used
+    entries are deleted.
+    """
+
+    def __init__(self, directory=None, max_bytes=1 << 30):
+        if directory is None:
+            directory = os.environ.get("CCM_GRAPH_CACHE",
+                                       os.path.join(os.path.expanduser("~"), ".cache", "ccmmodel", "graphs"))
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    def path(self, nodes, max_degree, seed, port_seed=None, generator="create_port_graph"):
+        port_seed = seed if port_seed is None else port_seed
+        key = f"v{_PG_VERSION}|{generator}|{nodes}|{max_degree}|{seed}|{port_seed}"
+        return os.path.join(self.directory, hashlib.sha1(key.encode()).hexdigest() + ".pg")
+
+    def get(self, nodes, max_degree, seed, port_seed=None, generator="create_port_graph"):
+        """Return the graph for these parameters, building and storing it on a miss.
+
+        port_seed defaults to seed, matching the create + randomize_ports(G, seed)
+        pattern used by the drivers.
+        """
+        path = self.path(nodes, max_degree, seed, port_seed, generator)
+        mmap = sys.platform != "emscripten"
+        try:
+            G = load_port_graph(path, mmap=mmap)
+        except (OSError, ValueError):
+            pass
+        else:
+            self.hits += 1
+            try:
+                os.utime(path)  # mtime doubles as the LRU timestamp
+            except OSError:
+                pass
+            return G
+        self.misses += 1
+        G = _build_port_graph(generator, nodes, max_degree, seed, seed if port_seed is None else port_seed)
+        os.makedirs(self.directory, exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        save_port_graph(G, tmp)
+        os.replace(tmp, path)
+        # hand back the stored copy, so a miss gives the same kind of graph
+        # (read-only, backed by `path`) as every later hit; map it before
+        # evicting, which may remove an entry larger than max_bytes
+        G = load_port_graph(path, mmap=mmap)
+        self._evict()
+        return G
+
+    def _evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".pg"):
+                continue
+            try:
+                st = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+            total -= size
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
+
+
+graph_cache = GraphCache()
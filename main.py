@@ -9,8 +9,7 @@ def main():
     nodes  = 100
     agent_count = 100
 
-    G = graph_utils.create_port_labeled_graph(nodes, 4, 42)
-    graph_utils.randomize_ports(G, 42)
+    G = graph_utils.graph_cache.get(nodes, 4, 42, generator="create_port_labeled_graph")
     agents = [agent_help_scouts.Agent(i, 0) for i in range(agent_count)]
 
     # ─── run ───
@@ -5,8 +5,8 @@ export const pyodideReady = loadPyodide({ indexURL: "https://cdn.jsdelivr.net/py
   .then(async (pyodide) => {
     console.log("Pyodide loaded.");
     // Removed matplotlib as it's not needed for the web visualization part
-    await pyodide.loadPackage(["networkx", "micropip"]);
-    console.log("Python packages (networkx, micropip) loaded.");
+    await pyodide.loadPackage(["networkx", "numpy", "micropip"]);
+    console.log("Python packages (networkx, numpy, micropip) loaded.");
     return pyodide;
   })
   .catch(err => {
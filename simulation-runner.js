@@ -13,6 +13,8 @@ export async function runSimulation(py, nodes, max_degree, agents, rounds, seed,
     'graph_utils.py',
     'agent_drop_freeze.py',
     'agent_help_scouts.py',      // NEW: parallel greedy algorithm
+    'simulation.py',             // trace levels + RunResult shared by the engines
+    'agent_store.py',            // struct-of-arrays agent storage used by both engines
     'simulation_wrapper.py'  // external script with core logic
   ];
   await Promise.all(pythonFiles.map(f => loadPyFile(py, f)));
@@ -1,3 +1,157 @@
 # simulation.py
+from collections import Counter
 
+# How much history run_simulation keeps, from nothing to every agent move.
+TRACE_NONE = "none"      # no frames; run_simulation returns a RunResult
+TRACE_FINAL = "final"    # only the final frame
+TRACE_ROUND = "round"    # one frame per synchronous round
+TRACE_MOVE = "move"      # every recorded move (the historical behaviour)
+TRACE_LEVELS = (TRACE_NONE, TRACE_FINAL, TRACE_ROUND, TRACE_MOVE)
 
+
+def check_trace_level(trace):
+    if trace not in TRACE_LEVELS:
+        raise ValueError(f"trace must be one of {TRACE_LEVELS}, got {trace!r}")
+    return trace
+
+
+class RunResult:
+    """Compact outcome of a run made with trace="none".
+
+    Per-agent lists are in agent-ID order.
+    """
+    def __init__(self, rounds, homes, tree_edges, moves, metrics=None):
+        self.rounds = rounds          # synchronous rounds used
+        self.homes = homes            # final home node per agent, None if unsettled
+        self.tree_edges = tree_edges  # [{"u", "v", "srcPort", "dstPort"}, ...] of the final tree
+        self.moves = moves            # edge traversals per agent
+        self.metrics = metrics        # Metrics of the run
+
+    @property
+    def total_moves(self):
+        return sum(self.moves)
+
+    @property
+    def dispersed(self):
+        homes = [h for h in self.homes if h is not None]
+        return len(homes) == len(self.homes) and len(set(homes)) == len(homes)
+
+    def __repr__(self):
+        return (f"RunResult(rounds={self.rounds}, agents={len(self.homes)}, "
+                f"total_moves={self.total_moves}, dispersed={self.dispersed})")
+
+
+class Metrics:
+    """Round and move accounting of a run, broken down by phase.
+
+    The engines fill one in as they go; pass your own to run_simulation
+    (`metrics=`) to get it with any trace level, or read RunResult.metrics.
+    Phase names are the engine's: help-by-scouts uses settle, probe, vacate,
+    forward, backtrack, shortcut, retrace and relocate (RunResult.rounds also
+    counts its opening round, which is in no phase, and with several
+    starting nodes the phases add up the rounds of DFSs running side by
+    side); drop-freeze uses probe_out, probe_back and move_out.
+    """
+    def __init__(self, phases=()):
+        self.rounds = Counter(dict.fromkeys(phases, 0))  # phase -> rounds spent in it
+        self.moves = Counter(dict.fromkeys(phases, 0))   # phase -> edge traversals, all agents
+        self.probe_passes = Counter()  # node -> probe passes made from it
+        self.shortcuts = 0             # times help-by-scouts' delta_v >= k - 1 shortcut fired
+        self.agent_moves = []          # edge traversals per agent (agent-ID order), set at the end
+
+    @property
+    def total_rounds(self):
+        return sum(self.rounds.values())
+
+    @property
+    def total_moves(self):
+        return sum(self.moves.values())
+
+    def as_dict(self):
+        """Flat {name: number} view, e.g. one CSV row: rounds.<phase>, moves.<phase>, ..."""
+        row = {f"rounds.{p}": n for p, n in self.rounds.items()}
+        row.update({f"moves.{p}": n for p, n in self.moves.items()})
+        row.update(total_rounds=self.total_rounds, total_moves=self.total_moves,
+                   probe_passes=sum(self.probe_passes.values()),
+                   probed_nodes=len(self.probe_passes), shortcuts=self.shortcuts)
+        return row
+
+    def __repr__(self):
+        return (f"Metrics(rounds={dict(self.rounds)}, moves={dict(self.moves)}, "
+                f"probe_passes={sum(self.probe_passes.values())}, shortcuts={self.shortcuts})")
+
+
+# Engine events and their levels. Subscribers choose events by name and/or
+# minimum level; emit sites check `events.active` before building the
+# payload, so with nobody subscribed an event costs one attribute read.
+DEBUG = 10
+INFO = 20
+EVENT_LEVELS = {
+    "settle": INFO,         # agent, node: the agent makes node its home
+    "vacate": INFO,         # agent, node: a settled agent leaves home to scout
+    "shortcut": INFO,       # node, agents: the remaining agents disperse in one step
+    "reconfigure": DEBUG,   # agent, node, parent, parentPort: the agent is re-parented
+    "probe-start": DEBUG,   # node, agent, scouts: parallel_probe begins at node
+    "retrace-step": DEBUG,  # node, port, agents: retrace moves the vacated agents on
+    "merge": INFO,          # node, agents, into: a DFS's agents join another DFS (general mode)
+}
+
+
+class Events:
+    """Named events with subscribers, checked cheaply by the engines.
+
+        events.subscribe(callback, names=("settle",))
+        if events.active:
+            events.emit("settle", agent=aid, node=v)
+
+    callback(name, fields) is called with the keyword fields of the event.
+    """
+    def __init__(self):
+        self.active = False
+        self._subs = []      # (callback, names or None, level)
+        self._by_name = {}   # event name -> callbacks, rebuilt lazily
+
+    def subscribe(self, callback, names=None, level=DEBUG):
+        """Call callback for the events in `names` (default: all) of at least `level`."""
+        self._subs.append((callback, None if names is None else frozenset(names), level))
+        self._changed()
+        return callback
+
+    def unsubscribe(self, callback):
+        self._subs = [s for s in self._subs if s[0] is not callback]
+        self._changed()
+
+    def _changed(self):
+        self._by_name = {}
+        self.active = bool(self._subs)
+
+    def emit(self, name, **fields):
+        subs = self._by_name.get(name)
+        if subs is None:
+            level = EVENT_LEVELS.get(name, DEBUG)
+            subs = self._by_name[name] = tuple(
+                cb for cb, names, min_level in self._subs
+                if (names is None or name in names) and level >= min_level)
+        for cb in subs:
+            cb(name, fields)
+
+
+events = Events()  # default hooks of run_simulation in both engines
+
+# how print_events renders an event; others print as "[name] k=v ..."
+EVENT_FORMATS = {
+    "shortcut": "shortcut taken",
+    "reconfigure": "[DBG_RECONF] psi_w={agent}@{node} NEW parent={parent} parentPort={parentPort}",
+}
+
+
+def print_events(events=events, names=None, level=DEBUG, file=None):
+    """Subscribe a printer for the engines' debug output; returns the callback."""
+    def printer(name, fields):
+        fmt = EVENT_FORMATS.get(name)
+        if fmt is None:
+            line = f"[{name}] " + " ".join(f"{k}={v}" for k, v in fields.items())
+        else:
+            line = fmt.format(**fields)
+        print(line, file=file)
+    return events.subscribe(printer, names, level)
@@ -3,7 +3,7 @@
 import json
 import networkx as nx
 from collections import defaultdict
-from graph_utils import create_port_labeled_graph, randomize_ports
+from graph_utils import graph_cache, randomize_ports
 import agent_drop_freeze
 import agent_help_scouts
 import random
@@ -85,13 +85,21 @@ algorithm           = _get_or_default("algorithm",           "Help by Scouts")
 # --- Graph and Agent Initialization ---
 if seed==137:
     G = create_specific_example_graph()
+    randomize_ports(G, seed)
     if __name__ == "__main__":
         print("Using fixed 7-node example graph (0-1-2 and 0-3-4).", file=sys.stderr)
 else:
-    G = create_port_labeled_graph(nodes, max_degree, seed)
+    G = graph_cache.get(nodes, max_degree, seed, generator="create_port_labeled_graph").to_networkx()
     if __name__ == "__main__":
         print(f'Graph created with {G.number_of_nodes()} nodes and {G.number_of_edges()} edges', file=sys.stderr)
-randomize_ports(G, seed)
+    # start positions come from the `random` state randomize_ports(G, seed)
+    # leaves behind; cached graphs skip it, so replay its draws (one
+    # sample of each node's ports) to keep saved seeds reproducing
+    random.seed(seed)
+    for node in G.nodes():
+        degree = G.degree(node)
+        if degree:
+            random.sample(range(degree), degree)
 
 for node in G.nodes():
     G.nodes[node]['agents'] = set()
@@ -127,6 +135,7 @@ if __name__ == "__main__": # Only print agent info when run directly
 # --- Execute Simulation ---
 # Initialize return variables in case simulation doesn't run
 all_positions, all_statuses, all_node_settled_states, all_homes, all_tree_edges = [], [], [], [], []
+node_states_encoding = "full"  # or "diff": per-frame changes only, rebuilt by the visualizer
 
 if agents and rounds > 0 and G.number_of_nodes() > 0:
     # pick the correct simulation module
@@ -135,7 +144,16 @@ if agents and rounds > 0 and G.number_of_nodes() > 0:
     else:
         sim_mod = agent_drop_freeze
 
-    all_positions, all_statuses, all_node_settled_states, all_homes, all_tree_edges = sim_mod.run_simulation(G, agents, rounds)
+    if sim_mod is agent_help_scouts:
+        # help-by-scouts hands back lazy frame views; JSON needs plain lists
+        all_positions, all_statuses, all_node_settled_states, all_homes, all_tree_edges = (
+            list(frames) for frames in sim_mod.run_simulation(G, agents, rounds))
+    else:
+        # drop-freeze has no homes/tree-edge frames; its node states go out
+        # as sparse diffs and its leaders/levels never change, so skip them
+        all_positions, all_statuses, _, _, node_states = sim_mod.run_simulation(G, agents, rounds)
+        all_node_settled_states = node_states.diffs
+        node_states_encoding = "diff"
     if __name__ == "__main__": # Only print simulation finished info when run directly
         print(f'Simulation finished after {len(all_positions) - 1} recorded steps.', file=sys.stderr)
 else:
@@ -173,7 +191,8 @@ result = {
   "statuses":  all_statuses,
   "homes":   all_homes,
   "tree_edges":    all_tree_edges,
-  "node_settled_states": all_node_settled_states
+  "node_settled_states": all_node_settled_states,
+  "node_states_encoding": node_states_encoding
 }
 
 resultJson = json.dumps(result, indent=2) # Convert to JSON string for printing
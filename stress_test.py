@@ -1,5 +1,19 @@
 # stress_test.py
+#
+#   python stress_test.py [-j JOBS] [--shard I/N] [--failures PATH] [--configs PATH]
+#
+# Runs help-by-scouts on random configurations in a process pool. --shard
+# splits the fixed test list between hosts, --failures writes the failing
+# configs as JSONL and --configs re-runs a list of configs instead, either
+# JSONL or the "nodes=.., agents=.., seed=.." lines of `file`.
+import argparse
+import json
+import multiprocessing
+import os
 import random
+import re
+import sys
+import time
 import traceback
 
 import graph_utils
@@ -11,48 +25,159 @@ RED   = "\033[91m"
 BOLD  = "\033[1m"
 RESET = "\033[0m"
 
+DEGREE = 4
+NUM_TESTS = 1000
+
 
 def run_one(nodes: int, agent_count: int, degree: int, seed: int):
-    G = graph_utils.create_port_labeled_graph(nodes, degree, seed)
-    graph_utils.randomize_ports(G, seed)
+    G = graph_utils.graph_cache.get(nodes, degree, seed, generator="create_port_labeled_graph")
     agents = [agent_help_scouts.Agent(i, 0) for i in range(agent_count)]
     agent_help_scouts.run_simulation(G, agents)
 
-def main():
-    rng = random.Random(0)
-
-    degree = 4
-    num_tests = 1000
 
+def make_tests(num_tests=NUM_TESTS, degree=DEGREE):
+    """The fixed list of test configs, as dicts of run_one's arguments."""
+    rng = random.Random(0)
     tests = []
     while len(tests)<num_tests:
         nodes = rng.randint(1, 30)
         agent_count = rng.randint(1, 80)
         seed = rng.randint(0, 10_000)
         if (agent_count<=nodes):
-            tests.append((nodes, agent_count, seed))
-
-    failures = 0
-
-    for i, (nodes, agent_count, seed) in enumerate(tests, start=1):
-        try:
-            run_one(nodes, agent_count, degree, seed)
-            print(f"[{i:03d}/{num_tests}] nodes={nodes:2d}, agents={agent_count:2d}, seed={seed:5d}  "
-                  f"{GREEN}{BOLD}PASSED{RESET}")
-        except Exception:
-            failures += 1
-            print(f"[{i:03d}/{num_tests}] nodes={nodes:2d}, agents={agent_count:2d}, seed={seed:5d}  "
-                  f"{RED}{BOLD}FAILED{RESET}")
-            print(f"{RED}{traceback.format_exc()}{RESET}")
-
-            # Uncomment to stop on first failure:
-            # break
-
-    if failures == 0:
-        print(f"\n{GREEN}{BOLD}ALL {num_tests} TESTS PASSED ✅{RESET}")
+            tests.append({"nodes": nodes, "agents": agent_count, "degree": degree, "seed": seed})
+    return tests
+
+
+_FILE_LINE = re.compile(r"nodes=\s*(\d+),\s*agents=\s*(\d+),\s*seed=\s*(\d+)")
+
+
+def load_configs(path, degree=DEGREE):
+    """Configs listed in `path`: JSONL (as written by --failures) or the
+    "nodes=.., agents=.., seed=.." lines of the known-bad list in `file`."""
+    configs = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith("{"):
+                c = json.loads(line)
+                configs.append({"nodes": c["nodes"], "agents": c["agents"],
+                                "degree": c.get("degree", degree), "seed": c["seed"]})
+                continue
+            m = _FILE_LINE.search(line)
+            if m is None:
+                raise ValueError(f"{path}: cannot read config from {line!r}")
+            nodes, agent_count, seed = map(int, m.groups())
+            configs.append({"nodes": nodes, "agents": agent_count, "degree": degree, "seed": seed})
+    return configs
+
+
+def shard(tests, index, count):
+    """Tests of shard `index` (0-based) out of `count`: every count-th test,
+    so the shards are disjoint, cover the list and are of even cost."""
+    if not 0 <= index < count:
+        raise ValueError(f"shard {index} out of range for {count} shards")
+    return tests[index::count]
+
+
+def _parse_shard(text):
+    m = re.fullmatch(r"(\d+)/(\d+)", text)
+    if m is None:
+        raise argparse.ArgumentTypeError(f"expected I/N, got {text!r}")
+    index, count = map(int, m.groups())
+    if not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f"shard {index} out of range for {count} shards")
+    return index, count
+
+
+def check(config):
+    """Run one config; returns it with "ok", "seconds" and, on failure,
+    "error" and "traceback"."""
+    result = dict(config)
+    start = time.perf_counter()
+    try:
+        run_one(config["nodes"], config["agents"], config["degree"], config["seed"])
+        result["ok"] = True
+    except Exception as e:
+        result["ok"] = False
+        result["error"] = f"{type(e).__name__}: {e}"
+        result["traceback"] = traceback.format_exc()
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+
+def run_tests(tests, jobs=None, chunksize=None):
+    """Yield check() of every test as it finishes, from a pool of `jobs`
+    processes (default: one per CPU; 1 runs in this process). Tests go to
+    the workers in chunks of `chunksize` (default: about 8 per worker)."""
+    jobs = jobs or os.cpu_count() or 1
+    if jobs == 1 or len(tests) <= 1:
+        yield from map(check, tests)
+        return
+    if chunksize is None:
+        chunksize = max(1, len(tests) // (8 * jobs))
+    with multiprocessing.Pool(jobs) as pool:
+        yield from pool.imap_unordered(check, tests, chunksize)
+
+
+def _describe(r):
+    return f"nodes={r['nodes']:2d}, agents={r['agents']:2d}, seed={r['seed']:5d}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run help-by-scouts on many random configs.")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="worker processes (default: one per CPU; 1 runs serially)")
+    parser.add_argument("--shard", type=_parse_shard, default=(0, 1), metavar="I/N",
+                        help="run only shard I (0-based) of N")
+    parser.add_argument("--tests", type=int, default=NUM_TESTS, help="number of random configs")
+    parser.add_argument("--configs", metavar="PATH",
+                        help="run the configs listed in PATH (JSONL or the format of `file`) instead")
+    parser.add_argument("--failures", metavar="PATH", help="write the failing configs to PATH as JSONL")
+    parser.add_argument("--chunksize", type=int, default=None, help="tests sent to a worker at a time")
+    parser.add_argument("-v", "--verbose", action="store_true", help="also print every passing config")
+    args = parser.parse_args(argv)
+
+    tests = load_configs(args.configs) if args.configs else make_tests(args.tests)
+    index, count = args.shard
+    tests = shard(tests, index, count)
+    label = f" (shard {index}/{count})" if count > 1 else ""
+    print(f"{len(tests)} tests{label}", file=sys.stderr)
+
+    start = time.perf_counter()
+    results = []
+    for r in run_tests(tests, args.jobs, args.chunksize):
+        results.append(r)
+        if not r["ok"]:
+            print(f"[{len(results):04d}/{len(tests)}] {_describe(r)}  {RED}{BOLD}FAILED{RESET}  {r['error']}")
+            if args.verbose:
+                print(f"{RED}{r['traceback']}{RESET}")
+        elif args.verbose:
+            print(f"[{len(results):04d}/{len(tests)}] {_describe(r)}  {GREEN}{BOLD}PASSED{RESET}")
+    wall = time.perf_counter() - start
+
+    failed = [r for r in results if not r["ok"]]
+    if args.failures:
+        # in test-list order, whatever order the workers finished in
+        key = lambda c: (c["nodes"], c["agents"], c["degree"], c["seed"])
+        position = {key(t): i for i, t in reversed(list(enumerate(tests)))}
+        with open(args.failures, "w") as f:
+            for r in sorted(failed, key=lambda r: position[key(r)]):
+                f.write(json.dumps({k: r[k] for k in ("nodes", "agents", "degree", "seed", "error", "seconds")}) + "\n")
+
+    busy = sum(r["seconds"] for r in results)
+    slowest = sorted(results, key=lambda r: r["seconds"], reverse=True)[:5]
+    print(f"\n{len(results) - len(failed)} passed, {len(failed)} failed{label} "
+          f"in {wall:.2f}s wall, {busy:.2f}s in runs")
+    for r in slowest:
+        print(f"  {r['seconds']:7.3f}s  {_describe(r)}  {'ok' if r['ok'] else 'FAILED'}")
+    if not failed:
+        print(f"\n{GREEN}{BOLD}ALL {len(results)} TESTS PASSED ✅{RESET}")
     else:
-        print(f"\n{RED}{BOLD}{failures}/{num_tests} TESTS FAILED ❌{RESET}")
+        print(f"\n{RED}{BOLD}{len(failed)}/{len(results)} TESTS FAILED ❌{RESET}")
+    return 1 if failed else 0
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
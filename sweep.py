@@ -0,0 +1,153 @@
+# sweep.py
+#
+#   python sweep.py -o results.csv --nodes 100 1000 --agents 50 500 --degree 4 \
+#       --starts 1 4 --seeds 0-9 --algorithm help_scouts drop_freeze [-j JOBS]
+#
+# Runs every combination of the grids (configs with more agents than nodes
+# are left out) in a process pool and appends one CSV row per run: the
+# config, wall time, peak memory, rounds and moves, plus the per-phase
+# Metrics columns. Rows are written as runs finish, and configs already in
+# the output file are skipped, so an interrupted sweep resumes where it
+# stopped. Failed runs are recorded too (status "error"); delete their rows
+# to retry them.
+import argparse
+import csv
+import itertools
+import multiprocessing
+import os
+import random
+import resource
+import sys
+import time
+
+import graph_utils
+import agent_drop_freeze
+import agent_help_scouts
+
+
+ALGORITHMS = ("help_scouts", "drop_freeze")
+CONFIG_COLUMNS = ("algorithm", "nodes", "agents", "degree", "starts", "seed")
+RESULT_COLUMNS = ("status", "error", "wall_seconds", "peak_rss_mb", "rss_growth_mb",
+                  "rounds", "total_moves", "max_agent_moves", "dispersed")
+METRIC_COLUMNS = tuple(
+    [f"rounds.{p}" for p in agent_help_scouts.PHASES + agent_drop_freeze.PHASES]
+    + [f"moves.{p}" for p in agent_help_scouts.PHASES + agent_drop_freeze.PHASES]
+    + ["total_rounds", "total_moves_by_phase", "probe_passes", "probed_nodes", "shortcuts"])
+COLUMNS = CONFIG_COLUMNS + RESULT_COLUMNS + METRIC_COLUMNS
+
+
+def _int_grid(text):
+    # "5", or an inclusive range "0-9"
+    lo, sep, hi = text.partition("-")
+    if not sep:
+        return [int(text)]
+    return list(range(int(lo), int(hi) + 1))
+
+
+def make_configs(nodes, agents, degree, starts, seeds, algorithms):
+    """Every combination of the grids, as dicts keyed by CONFIG_COLUMNS,
+    without the ones with more agents than nodes."""
+    return [dict(zip(CONFIG_COLUMNS, c))
+            for c in itertools.product(algorithms, nodes, agents, degree, starts, seeds)
+            if c[2] <= c[1]]
+
+
+def _key(config):
+    return tuple(str(config[c]) for c in CONFIG_COLUMNS)
+
+
+def _peak_rss_mb():
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_config(config):
+    """Run one config; returns its CSV row."""
+    row = dict(config)
+    n, k = config["nodes"], config["agents"]
+    G = graph_utils.graph_cache.get(n, config["degree"], config["seed"])
+    rng = random.Random(config["seed"])
+    starts = rng.sample(range(n), min(config["starts"], n))
+    positions = [rng.choice(starts) for _ in range(k)]
+    if config["algorithm"] == "help_scouts":
+        agents = [agent_help_scouts.Agent(i, u) for i, u in enumerate(positions)]
+        run = lambda: agent_help_scouts.run_simulation(G, agents, trace="none")
+    else:
+        agents = [agent_drop_freeze.Agent(i, u) for i, u in enumerate(positions)]
+        run = lambda: agent_drop_freeze.run_simulation(G, agents, 4 * n, trace="none")
+
+    base = _peak_rss_mb()
+    start = time.perf_counter()
+    try:
+        result = run()
+    except Exception as e:
+        row.update(status="error", error=f"{type(e).__name__}: {e}")
+        result = None
+    row["wall_seconds"] = round(time.perf_counter() - start, 6)
+    peak = _peak_rss_mb()
+    row["peak_rss_mb"] = round(peak, 1)
+    row["rss_growth_mb"] = round(peak - base, 1)
+    if result is not None:
+        metrics = result.metrics.as_dict()
+        metrics["total_moves_by_phase"] = metrics.pop("total_moves")
+        row.update(metrics)
+        row.update(status="ok", rounds=result.rounds, total_moves=result.total_moves,
+                   max_agent_moves=max(result.moves, default=0), dispersed=result.dispersed)
+    return row
+
+
+def run_sweep(configs, out, jobs=None):
+    """Append a row to the CSV file `out` for every config it has no row
+    for yet, running them in `jobs` processes (default: one per CPU).
+    Each run gets a fresh worker process, so its peak memory is its own.
+    Returns the number of runs made."""
+    done = set()
+    header = COLUMNS
+    if os.path.exists(out) and os.path.getsize(out) > 0:
+        with open(out, newline="") as f:
+            reader = csv.DictReader(f)
+            header = tuple(reader.fieldnames)
+            done = {_key(row) for row in reader}
+    todo = [c for c in configs if _key(c) not in done]
+    print(f"{len(configs)} configs, {len(configs) - len(todo)} already in {out}, {len(todo)} to run",
+          file=sys.stderr)
+    if not todo:
+        return 0
+
+    jobs = jobs or os.cpu_count() or 1
+    with open(out, "a", newline="") as f:
+        writer = csv.DictWriter(f, header, extrasaction="ignore")
+        if not done:
+            writer.writeheader()
+        with multiprocessing.Pool(jobs, maxtasksperchild=1) as pool:
+            for i, row in enumerate(pool.imap_unordered(run_config, todo), start=1):
+                writer.writerow(row)
+                f.flush()
+                print(f"[{i}/{len(todo)}] " + " ".join(f"{c}={row[c]}" for c in CONFIG_COLUMNS)
+                      + f"  {row['status']} {row['wall_seconds']:.3f}s", file=sys.stderr)
+    return len(todo)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time the dispersion algorithms over a parameter grid.")
+    parser.add_argument("-o", "--output", required=True, metavar="CSV",
+                        help="results file; configs already in it are skipped")
+    parser.add_argument("--nodes", type=_int_grid, nargs="+", default=[[100]])
+    parser.add_argument("--agents", type=_int_grid, nargs="+", default=[[50]])
+    parser.add_argument("--degree", type=_int_grid, nargs="+", default=[[4]])
+    parser.add_argument("--starts", type=_int_grid, nargs="+", default=[[1]],
+                        help="starting nodes (more than 1 runs help-by-scouts' general_async)")
+    parser.add_argument("--seeds", type=_int_grid, nargs="+", default=[[0]],
+                        help="seeds, or ranges like 0-9")
+    parser.add_argument("--algorithm", nargs="+", choices=ALGORITHMS, default=list(ALGORITHMS))
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="worker processes (default: one per CPU)")
+    args = parser.parse_args(argv)
+
+    flat = lambda grids: [x for grid in grids for x in grid]
+    configs = make_configs(flat(args.nodes), flat(args.agents), flat(args.degree),
+                           flat(args.starts), flat(args.seeds), args.algorithm)
+    run_sweep(configs, args.output, args.jobs)
+
+
+if __name__ == "__main__":
+    main()